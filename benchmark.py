@@ -0,0 +1,227 @@
+import argparse
+import copy
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+import board_generation
+import testing
+from game import Board, get_shot_value
+from example_ussage import (generate_boards, test_board1, test_board2, test_board3,
+                            test_board4, test_board5, test_board6)
+
+
+BOARD_SIZES = 10, 10
+SHIP_SIZES = [6, 4, 4, 3, 3, 3, 2, 2, 2, 2]
+SHIPS_DETAILS = [("Schlachtschiff", 6, 1), ("Kreuzer", 4, 2),
+                 ("Zerstörer", 3, 3), ("UBoot", 2, 4)]
+
+# large enough for the enumerating engines to take about a second (analyze
+# 0.9 s, analyze_parallel 1.2 s), so pool startup and noise stay well below
+# the regression tolerance. analyze_counting takes 0.12 s
+EXACT_BOARD = 8, 8, [4, 3, 3, 2]
+
+TEST_BOARDS = {
+    "test_board1": test_board1,
+    "test_board2": test_board2,
+    "test_board3": test_board3,
+    "test_board4": test_board4,
+    "test_board5": test_board5,
+    "test_board6": test_board6,
+}
+
+
+def time_call(func, repeat: int, setup=None, min_seconds: float = 0.2) -> dict[str, float]:
+    """Time func in repeat loops of at least min_seconds each and return the seconds per call.
+
+    The calls per loop are found like timeit.Timer.autorange and, as in
+    timeit, the garbage collector is off while timing. If setup is given it
+    is called untimed for every call and its result passed on.
+    """
+    def loop(number):
+        seconds = 0.0
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(number):
+                args = () if setup is None else (setup(),)
+                start = time.perf_counter()
+                func(*args)
+                seconds += time.perf_counter() - start
+            return seconds
+        finally:
+            gc.enable()
+
+    # 1, 2, 5, 10, 20, 50, ... calls until a loop takes min_seconds
+    number = 1
+    while loop(number) < min_seconds:
+        number = number * 5 // 2 if str(number)[0] == "2" else number * 2
+
+    times = [loop(number) / number for _ in range(repeat)]
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def capture_phases(test_board, seed: int = 0) -> dict[str, tuple]:
+    """Replay a game and capture the board state at the opening, mid-game and endgame."""
+    random.seed(seed)
+
+    board = Board(BOARD_SIZES, SHIP_SIZES.copy())
+    _test_board = copy.deepcopy(test_board)
+
+    phases = {}
+    while board.ship_sizes:
+
+        state = board.board.copy(), board.ship_sizes.copy()
+        n_hit_groups = len(board.get_hit_groups())
+
+        phases.setdefault("opening", state)
+        # the first state with several open hit groups, else with one
+        if n_hit_groups >= 2:
+            phases.setdefault("midgame", state)
+        elif n_hit_groups == 1:
+            phases.setdefault("midgame_single", state)
+        if len(board.ship_sizes) <= 2:
+            phases.setdefault("endgame", state)
+
+        board.calculate_probability_density()
+        shot = board.best_possible_shot()
+        board.update_board_value(shot, get_shot_value(_test_board, shot))
+
+    if "midgame" not in phases and "midgame_single" in phases:
+        phases["midgame"] = phases["midgame_single"]
+    phases.pop("midgame_single", None)
+
+    return phases
+
+
+def bench_density(repeat: int) -> dict[str, dict]:
+    results = {}
+
+    for name, test_board in TEST_BOARDS.items():
+        for phase, (cells, ship_sizes) in capture_phases(test_board).items():
+
+            def setup():
+                board = Board(BOARD_SIZES, ship_sizes.copy())
+                board.board = cells.copy()
+                return board
+
+            results[f"game.calculate_probability_density[{name}:{phase}]"] = time_call(
+                lambda board: board.calculate_probability_density(), repeat, setup)
+
+    return results
+
+
+def bench_exact(repeat: int) -> dict[str, dict]:
+    width, height, ship_sizes = EXACT_BOARD
+    board = testing.Board(width, height, ship_sizes)
+
+    return {
+        "testing.analyze": time_call(board.analyze, repeat),
+        "testing.analyze_parallel": time_call(board.analyze_parallel, repeat),
+        "testing.analyze_counting": time_call(board.analyze_counting, repeat),
+    }
+
+
+def bench_generation(repeat: int) -> dict[str, dict]:
+    ship_positions, ranges = board_generation.generate_ship_positions(
+        SHIPS_DETAILS, BOARD_SIZES)
+
+    return {
+        "board_generation.generate_ship_positions": time_call(
+            lambda: board_generation.generate_ship_positions(SHIPS_DETAILS, BOARD_SIZES), repeat),
+        "board_generation.generate_filter_lookup": time_call(
+            lambda: board_generation.generate_filter_lookup(ship_positions, ranges), repeat),
+        "example_ussage.generate_boards[1000]": time_call(
+            lambda: generate_boards(BOARD_SIZES, SHIP_SIZES, 1000, seed=0), repeat),
+    }
+
+
+SUITES = {
+    "density": bench_density,
+    "exact": bench_exact,
+    "generation": bench_generation,
+}
+
+
+def run_benchmarks(suites: list[str], repeat: int) -> dict:
+    """Run the given suites and return their results with some machine information."""
+    results = {}
+    for suite in suites:
+        results.update(SUITES[suite](repeat))
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return a line for every benchmark whose per call minimum is slower than the baseline by more than tolerance."""
+    regressions = []
+
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["min"]
+        after = result["min"]
+        if after > before * (1 + tolerance):
+            regressions.append(
+                f"{name}: {before:.5f}s -> {after:.5f}s ({after / before - 1:+.0%})")
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the battleship engines.")
+    parser.add_argument("--suite", nargs="+", choices=list(SUITES), default=list(SUITES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative slowdown of the per call minimum before flagging")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.suite, args.repeat)
+
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+
+    for name, result in current["results"].items():
+        print(f"{name:70s} {result['min']:.5f}s")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(current, baseline, args.tolerance)
+    for line in regressions:
+        print("REGRESSION", line)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
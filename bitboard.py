@@ -0,0 +1,134 @@
+import numpy as np
+
+import game
+import testing
+from symmetry import apply_symmetry, board_symmetries
+
+
+def _to_bits(mask) -> int:
+    """Pack a flat bool array into an int, cell i being bit i."""
+    return int.from_bytes(np.packbits(np.asarray(mask, dtype=bool), bitorder="little").tobytes(), "little")
+
+
+def _from_bits(bits: int, n_cells: int) -> np.ndarray:
+    """Unpack an int into a flat bool array of n_cells cells."""
+    raw = np.frombuffer(bits.to_bytes((n_cells + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little")[:n_cells].astype(bool)
+
+
+# testing.CellState for every game.Board cell value and back
+_CELL_STATES = {
+    game.Board.UNKNOWN: testing.CellState.UNKNOWN,
+    game.Board.MISS: testing.CellState.MISS,
+    game.Board.HIT: testing.CellState.HIT,
+    game.Board.SUNK: testing.CellState.SUNK,
+}
+_CELL_VALUES = {state: value for value, state in _CELL_STATES.items()}
+
+
+class BitBoard:
+    """Immutable board state as one int per shot status plus the remaining ships.
+
+    Bit r * n_cols + c of miss, hit and sunk is set if cell (r, c) has that
+    status, cells in none of them are unknown. The remaining ship sizes are
+    kept sorted in descending order, so equal states compare and hash equal
+    no matter how they were reached. The hash is computed once.
+    """
+
+    __slots__ = ("n_rows", "n_cols", "miss", "hit", "sunk", "ship_sizes", "_hash")
+
+    def __init__(self, n_rows: int, n_cols: int, miss: int = 0, hit: int = 0, sunk: int = 0,
+                 ship_sizes=()):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.miss = miss
+        self.hit = hit
+        self.sunk = sunk
+        self.ship_sizes = tuple(sorted(ship_sizes, reverse=True))
+        self._hash = hash((n_rows, n_cols, miss, hit, sunk, self.ship_sizes))
+
+    def _key(self) -> tuple:
+        return self.n_rows, self.n_cols, self.miss, self.hit, self.sunk, self.ship_sizes
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, BitBoard):
+            return NotImplemented
+        return self._hash == other._hash and self._key() == other._key()
+
+    def __getstate__(self):
+        return self._key()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return (f"BitBoard({self.n_rows}x{self.n_cols}, miss={self.miss:#x}, hit={self.hit:#x}, "
+                f"sunk={self.sunk:#x}, ship_sizes={list(self.ship_sizes)})")
+
+    @classmethod
+    def from_cells(cls, cells, ship_sizes) -> "BitBoard":
+        """Build the state from a 2d array of game.Board cell values."""
+        cells = np.asarray(cells)
+        n_rows, n_cols = cells.shape
+        flat = cells.ravel()
+
+        return cls(n_rows, n_cols,
+                   _to_bits(flat == game.Board.MISS),
+                   _to_bits(flat == game.Board.HIT),
+                   _to_bits(flat == game.Board.SUNK),
+                   ship_sizes)
+
+    def cells(self) -> np.ndarray:
+        """Return the state as a 2d uint8 array of game.Board cell values."""
+        n_cells = self.n_rows * self.n_cols
+
+        cells = np.full(n_cells, game.Board.UNKNOWN, dtype=np.uint8)
+        cells[_from_bits(self.miss, n_cells)] = game.Board.MISS
+        cells[_from_bits(self.hit, n_cells)] = game.Board.HIT
+        cells[_from_bits(self.sunk, n_cells)] = game.Board.SUNK
+
+        return cells.reshape(self.n_rows, self.n_cols)
+
+    @classmethod
+    def from_game_board(cls, board: game.Board) -> "BitBoard":
+        return cls.from_cells(board.board, board.ship_sizes)
+
+    def to_game_board(self, **kwargs) -> game.Board:
+        """Return a new game.Board in this state, kwargs go to its constructor."""
+        board = game.Board((self.n_rows, self.n_cols), list(self.ship_sizes), **kwargs)
+        board.board = self.cells()
+        return board
+
+    @classmethod
+    def from_testing_board(cls, board: testing.Board) -> "BitBoard":
+        cells = [[_CELL_VALUES[cell] for cell in row] for row in board.cells]
+        return cls.from_cells(cells, board.ship_sizes)
+
+    def to_testing_board(self) -> testing.Board:
+        """Return a new testing.Board in this state."""
+        board = testing.Board(self.n_cols, self.n_rows, list(self.ship_sizes))
+        board.cells = [[_CELL_STATES[value] for value in row] for row in self.cells().tolist()]
+        return board
+
+    def transform(self, image: np.ndarray) -> "BitBoard":
+        """Return the state moved by a symmetry from symmetry.board_symmetries."""
+        cells = apply_symmetry(self.cells(), image).reshape(self.n_rows, self.n_cols)
+        return BitBoard.from_cells(cells, self.ship_sizes)
+
+    def canonical(self) -> tuple["BitBoard", np.ndarray]:
+        """Return the smallest state among all symmetric ones and the symmetry leading to it.
+
+        Symmetric states have the same canonical state, so it serves as a key
+        for deduplicating them. Per cell values of this state move to the
+        canonical orientation with symmetry.apply_symmetry(values, image).
+        """
+        best = None
+        for image in board_symmetries(self.n_rows, self.n_cols):
+            state = self.transform(image)
+            if best is None or (state.miss, state.hit, state.sunk) < (best[0].miss, best[0].hit, best[0].sunk):
+                best = state, image
+
+        return best
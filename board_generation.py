@@ -1,6 +1,8 @@
 import numpy as np
 import sys
 
+from symmetry import board_symmetries, canonical_placements
+
 
 def calculate_total_size(d):
     total_size = sys.getsizeof(d)  # Size of the dictionary itself
@@ -140,29 +142,53 @@ def generate_filter_lookup(ship_positions: dict[int, tuple[set[int], set[int]]],
     return filter_lookup
 
 
+def canonical_first_positions(ship_positions: dict[int, tuple[set[int], set[int]]], ranges: list[set[int]]) -> dict[int, int]:
+
+    # coord_to_num is x + y * a, so the board has b rows of a cells
+    a, b = ship_positions["board_size"]
+
+    ids = sorted(list(ranges[0]))
+    placements = {frozenset(ship_positions[id][0]) for id in ids}
+
+    # only symmetries mapping the generated positions onto themselves
+    symmetries = [image for image in board_symmetries(b, a) if all(
+        frozenset(image[list(p)].tolist()) in placements for p in placements)]
+
+    weights = canonical_placements(
+        [ship_positions[id][0] for id in ids], symmetries)
+
+    return {ids[index]: weight for index, weight in weights.items()}
+
+
 k = 0
 
 
-def recursion(ship_positions: dict[int, set[int]], filter_lookup: dict[int, set[int]], ranges: list[set[int]], redundancy: dict[int, set[int]], pos_ids: list[int] = []) -> None:
+def recursion(ship_positions: dict[int, set[int]], filter_lookup: dict[int, set[int]], ranges: list[set[int]], redundancy: dict[int, set[int]], pos_ids: list[int] = [], first_ids: dict[int, int] = None, weight: int = 1) -> None:
 
     if len(ranges) == 0:  # base case
         global k
-        if k % 1_000_000 == 0:
+        # k counts configurations, a leaf stands for weight of them
+        if (k + weight - 1) // 1_000_000 != (k - 1) // 1_000_000:
             draw_board(pos_ids, ship_positions, ship_positions["board_size"])
             ranges_int = ship_positions["ranges_int"]
             scaled_pos_ids = [a-b for (a, b) in zip(pos_ids, ranges_int)]
             print(scaled_pos_ids)
             print("\033[H", end="")
-        k += 1
+        k += weight
         return
 
-    for id in sorted(list(ranges[0])):
+    # first_ids maps one first ship position per symmetry orbit to its orbit size
+    ids = sorted(list(ranges[0])) if first_ids is None else sorted(first_ids)
+
+    for id in ids:
 
         ranges_filter = filter_lookup[id]
         _ranges = subtract_sets(ranges[1:], ranges_filter)
 
+        _weight = weight if first_ids is None else weight * first_ids[id]
+
         recursion(ship_positions, filter_lookup,
-                  _ranges, redundancy, pos_ids + [id])
+                  _ranges, redundancy, pos_ids + [id], weight=_weight)
 
         ship_num = len(pos_ids)
         if ship_num in redundancy:
@@ -182,3 +208,9 @@ def recursion(ship_positions: dict[int, set[int]], filter_lookup: dict[int, set[
 # redundancy = {1:{1}, 3:{1,2}, 4:{1}, 6:{1,2,3}, 7:{1,2}, 8:{1}}
 
 # recursion(ship_positions, filter_lookup, ranges, redundancy)
+
+# only place the first ship once per symmetry orbit of the empty board
+
+# first_ids = canonical_first_positions(ship_positions, ranges)
+
+# recursion(ship_positions, filter_lookup, ranges, redundancy, first_ids=first_ids)
@@ -0,0 +1,136 @@
+import argparse
+import sys
+
+from game import Board, TranspositionTable
+
+
+VALUES = {"M": Board.MISS, "H": Board.HIT, "S": Board.SUNK}
+
+USAGE = """Line protocol, one record per line, fields separated by spaces, cells 0-based:
+
+    in   N <game> [<rows>x<cols>] [<ship sizes, comma separated>]   start a game
+    in   R <game> <row> <col> <M|H|S>                               result of a shot
+    in   Q <game>                                                   drop a game
+    out  S <game> <row> <col>                                       recommended shot
+    out  D <game> <rounds>                                          all ships sunk
+    out  E <game> <message>                                         rejected record
+
+With rendering the board follows every recommendation as lines starting with #.
+"""
+
+
+class HeadlessDriver:
+    """Non-interactive counterpart of Board.start_game for many games at once.
+
+    Reads shot results and writes recommended shots as compact records, see
+    USAGE. Every game keeps its own incremental Board, all of them share one
+    TranspositionTable if table_bytes is given.
+    """
+
+    def __init__(self, board_sizes, ship_sizes, output=sys.stdout, render=False, table_bytes=None):
+        self.board_sizes = tuple(board_sizes)
+        self.ship_sizes = list(ship_sizes)
+        self.output = output
+        self.render = render
+        self.transposition_table = TranspositionTable(table_bytes) if table_bytes else None
+        self.games = {}
+        self.rounds = {}
+
+    def write(self, *fields):
+        self.output.write(" ".join(map(str, fields)) + "\n")
+
+    def recommend(self, game_id):
+
+        board = self.games[game_id]
+
+        board.calculate_probability_density()
+        row, col = board.best_possible_shot()
+        self.rounds[game_id] += 1
+
+        self.write("S", game_id, row, col)
+
+        if self.render:
+            for line in str(board).splitlines():
+                self.write("#", line)
+
+    def new_game(self, game_id, fields):
+
+        board_sizes, ship_sizes = self.board_sizes, self.ship_sizes
+        for field in fields:
+            if "x" in field:
+                board_sizes = tuple(int(n) for n in field.split("x"))
+            else:
+                ship_sizes = [int(n) for n in field.split(",")]
+
+        self.games[game_id] = Board(board_sizes, list(ship_sizes),
+                                    transposition_table=self.transposition_table)
+        self.rounds[game_id] = 0
+
+        self.recommend(game_id)
+
+    def result(self, game_id, fields):
+
+        board = self.games[game_id]
+
+        row, col, value = int(fields[0]), int(fields[1]), VALUES[fields[2].upper()]
+
+        # rejected records leave the game unchanged
+        board.check_board_value((row, col), value)
+        board.update_board_value((row, col), value)
+
+        if len(board.ship_sizes) == 0:
+            self.write("D", game_id, self.rounds.pop(game_id))
+            del self.games[game_id]
+            return
+
+        self.recommend(game_id)
+
+    def handle(self, line: str):
+
+        fields = line.split()
+        if not fields:
+            return
+
+        kind, game_id, fields = fields[0].upper(), fields[1] if len(fields) > 1 else "-", fields[2:]
+
+        try:
+            if kind == "N":
+                self.new_game(game_id, fields)
+            elif kind == "R":
+                if game_id not in self.games:
+                    raise KeyError(f"unknown game {game_id}")
+                self.result(game_id, fields)
+            elif kind == "Q":
+                self.games.pop(game_id, None)
+                self.rounds.pop(game_id, None)
+            else:
+                raise ValueError(f"unknown record {kind}")
+
+        except (ValueError, KeyError, IndexError) as error:
+            self.write("E", game_id, str(error).strip("'\""))
+
+    def run(self, input=sys.stdin):
+        for line in input:
+            self.handle(line)
+            self.output.flush()
+
+
+def main():
+
+    from example_ussage import BOARD_SIZES, SHIP_SIZES
+
+    parser = argparse.ArgumentParser(
+        description="Recommend shots over a line protocol on stdin and stdout.",
+        epilog=USAGE, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--render", action="store_true",
+                        help="write the probability board after every recommendation")
+    parser.add_argument("--table-bytes", type=int, default=None,
+                        help="share a transposition table of this size between the games")
+    args = parser.parse_args()
+
+    HeadlessDriver(BOARD_SIZES, SHIP_SIZES, render=args.render,
+                   table_bytes=args.table_bytes).run()
+
+
+if __name__ == "__main__":
+    main()
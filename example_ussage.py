@@ -1,4 +1,6 @@
 import random
+from functools import lru_cache
+import numpy as np
 from game import Board, get_average_round_num, print_placement
 
 test_board1 = [[(4, 9), (5, 9), (6, 9), (7, 9), (8, 9), (9, 9)],
@@ -71,115 +73,141 @@ test_board6 = [[(7, 0), (7, 1), (7, 2), (7, 3), (7, 4), (7, 5)],
 test_boards = [test_board1, test_board2, test_board3, test_board4, test_board5]
 
 
-def generate_board(board_sizes, ship_sizes):
+@lru_cache(maxsize=None)
+def placement_tables(board_sizes, ship_sizes):
+    """All legal placements of the ship sizes on the empty board, as (size, row, col, vertical) rows,
+    with their ship cells and padded cells packed into uint64 words."""
 
-    width, height = board_sizes
+    board = Board(board_sizes, list(ship_sizes))
 
-    while True:
+    placements = board.get_placement_array()
+    ship_cells, padded_cells = board.get_placement_cells(placements)
 
-        skip = False
+    def pack(cells):
+        n_words = -(-cells.shape[1] // 64)
+        bits = np.zeros((len(cells), n_words * 64), dtype=bool)
+        bits[:, :cells.shape[1]] = cells
+        return np.packbits(bits, axis=1, bitorder="little").view(np.uint64)
 
-        # pick starting point and direction for every ship
-        dirs = [(0, 1), (1, 0)]
-        pickable_points = [(r, c) for r in range(height) for c in range(width)]
+    return placements, pack(ship_cells), pack(padded_cells)
 
-        test_board = []
-        for ss in ship_sizes:
 
-            # pick direction
-            dir = random.choice(dirs)
+def generate_boards(board_sizes, ship_sizes, n_boards, uniform=False, seed=None, batch_size=4096):
+    """Generate n_boards legal fleets as an (n_boards, len(ship_sizes), 3) array of (row, col, vertical).
 
-            # pick starting point
-            if dir == (0, 1):
-                _pickable_points = [(r, c)
-                                    for r, c in pickable_points if c < width - ss]
-            else:
-                _pickable_points = [(r, c)
-                                    for r, c in pickable_points if r < height - ss]
+    Ships are placed in the order of ship_sizes, every ship at a random
+    placement that fits next to the ships before it, restarting the rare
+    fleets that run out of space. This favours fleets with few options
+    late in the placement order. With uniform every step is also accepted
+    with probability (placements that fit) / (an upper bound of them),
+    which samples all legal fleets with equal probability but rejects most
+    draws for large fleets.
+    """
 
-            if len(_pickable_points) == 0:
-                skip = True
-                break
+    rng = np.random.default_rng(seed)
 
-            r, c = random.choice(_pickable_points)
+    placements, ship_cells, padded_cells = placement_tables(
+        tuple(board_sizes), tuple(sorted(set(ship_sizes))))
+    options = {ss: np.flatnonzero(placements[:, 0] == ss) for ss in set(ship_sizes)}
 
-            # create ship coords
-            ship_coords = set([(r+x, c+y) for x in range(1 + dir[0]*(ss-1))
-                               for y in range(1 + dir[1]*(ss-1))])
+    if uniform:
+        # every ship placed before blocks at least the placements its least
+        # blocking placement does, which bounds the placements that fit
+        blocked = {ss: ((ship_cells[options[ss]][:, None] & padded_cells[None]) != 0).any(axis=2).sum(axis=0)
+                   for ss in set(ship_sizes)}
+        bounds = [len(options[ss]) - max([blocked[ss][options[prev]].min() for prev in ship_sizes[:k]], default=0)
+                  for k, ss in enumerate(ship_sizes)]
 
-            # check for overlaps
-            padded_ship_coords = set(
-                [(r+x, c+y) for x in [-1, 0, 1] for y in [-1, 0, 1] for r, c in ship_coords])
+    fleets = []
+    n_fleets = 0
+    acceptance = 1.0
 
-            if any(not padded_ship_coords.isdisjoint(other) for other in test_board):
-                skip = True
+    while n_fleets < n_boards:
 
-            if skip:
-                break
+        n = int(min((n_boards - n_fleets) / acceptance + 1, batch_size))
+        if uniform:
+            n = int(min(max((n_boards - n_fleets) / acceptance, batch_size), 8 * batch_size))
 
-            for coord in padded_ship_coords:
-                if coord in pickable_points:
-                    pickable_points.remove(coord)
+        rows = np.arange(n)
+        chosen = np.empty((n, len(ship_sizes)), dtype=np.int64)
+        occupied = np.zeros((n, ship_cells.shape[1]), dtype=np.uint64)
 
-            test_board.append(ship_coords)
+        for k, ss in enumerate(ship_sizes):
 
-        if skip:
-            continue
+            compatible = ((ship_cells[options[ss]][None] &
+                           occupied[rows][:, None]) == 0).all(axis=2)
+            n_compatible = compatible.sum(axis=1)
 
-        return test_board
+            # a uniform pick among the placements that fit
+            scores = rng.random(compatible.shape) * compatible
+            pick = options[ss][np.argmax(scores, axis=1)]
 
+            fits = n_compatible > 0
+            if uniform:
+                fits &= rng.random(len(rows)) * bounds[k] < n_compatible
 
-# Constants
-BOARD_SIZES = 10, 10  # Standard Battleship board size is 10x10
-# Standard Battleship ship sizes
-SHIP_SIZES = [6, 4, 4, 3, 3, 3, 2, 2, 2, 2]
+            rows, pick = rows[fits], pick[fits]
+            chosen[rows, k] = pick
+            occupied[rows] |= padded_cells[pick]
+
+        acceptance = max(len(rows), 1) / n
+
+        fleets.append(chosen[rows])
+        n_fleets += len(rows)
 
-board = Board(BOARD_SIZES, SHIP_SIZES)
+    fleets = np.concatenate(fleets)[:n_boards]
 
+    return placements[fleets][..., 1:]
 
-# play a game with generated test board
 
-# test_board = generate_board(BOARD_SIZES, SHIP_SIZES)
+def fleet_to_test_board(fleet, ship_sizes):
+    """Convert one fleet of generate_boards into a test board, a list of ship cell sets."""
 
-print_placement([coord for ship in test_board6 for coord in ship], (10, 10))
+    test_board = []
+    for ss, (row, col, vertical) in zip(ship_sizes, fleet.tolist()):
+        if vertical:
+            test_board.append({(r, col) for r in range(row, row + ss)})
+        else:
+            test_board.append({(row, c) for c in range(col, col + ss)})
 
-# get_average_round_num(board, test_board4, 100)
+    return test_board
 
-board.test_game(test_board4)
 
-# calculate averages, max and min over history boards
+def generate_board(board_sizes, ship_sizes):
+
+    # seeded from random, so random.seed still makes boards reproducible
+    fleet = generate_boards(board_sizes, ship_sizes, 1, batch_size=1,
+                            seed=random.getrandbits(64))[0]
 
-# for test_board in test_boards:
+    return fleet_to_test_board(fleet, ship_sizes)
 
-#     get_average_round_num(board, test_board, 200)
 
+# Constants
+BOARD_SIZES = 10, 10  # Standard Battleship board size is 10x10
+# Standard Battleship ship sizes
+SHIP_SIZES = [6, 4, 4, 3, 3, 3, 2, 2, 2, 2]
+
+if __name__ == "__main__":
 
-# get average, max and min over 200 generated boards
+    board = Board(BOARD_SIZES, SHIP_SIZES)
 
-# print("\n")
-# average = mx = mn = k = 0
-# for k in range(1, 201):
+    # play a game with generated test board
 
-#     board = Board(BOARD_SIZES, SHIP_SIZES)
+    # test_board = generate_board(BOARD_SIZES, SHIP_SIZES)
 
-#     test_board = generate_board(BOARD_SIZES, SHIP_SIZES)
+    print_placement([coord for ship in test_board6 for coord in ship], (10, 10))
 
-#     rounds = board.test_game(test_board, 0)
+    # get_average_round_num(board, test_board4, 100)
 
-#     if mn == 0:
-#         mn = rounds
+    board.test_game(test_board4)
 
-#     if rounds < mn:
-#         mn = rounds
+    # calculate averages, max and min over history boards
 
-#     if rounds > mx:
-#         mx = rounds
+    # for test_board in test_boards:
 
-#     average += rounds
+    #     get_average_round_num(board, test_board, 200)
 
-#     print("\033[2K", end="\r")
-#     print("\x1b[A", end="\r")
-#     print("\033[2K", end="\r")
+    # get average, max and min over 200 generated boards, spread over all cores
 
-#     print(f"total games played: {k}, average: {
-#           round(average/k, 4)}, max: {mx}, min: {mn}")
+    # results = simulate_games(BOARD_SIZES, SHIP_SIZES, n_games=200, seed=0)
+    # print(results["rounds_stats"], results["turn_time_stats"])
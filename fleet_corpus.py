@@ -0,0 +1,166 @@
+import argparse
+
+import numpy as np
+
+from game import Board
+from example_ussage import generate_boards
+
+
+MAGIC = b"FLEETCRP"
+VERSION = 1
+
+# magic, then version, n_rows, n_cols, n_ships, n_words and n_fleets as
+# little endian uint32, then the ship sizes as uint8 padded to 8 bytes
+HEADER_FIELDS = np.dtype([("version", "<u4"), ("n_rows", "<u4"), ("n_cols", "<u4"),
+                          ("n_ships", "<u4"), ("n_words", "<u4"), ("n_fleets", "<u4")])
+
+
+def _header_size(n_ships: int) -> int:
+    return len(MAGIC) + HEADER_FIELDS.itemsize + -(-n_ships // 8) * 8
+
+
+def fleet_masks(fleets, board_sizes, ship_sizes) -> np.ndarray:
+    """Ship cell masks of (n, n_ships, 3) fleets from generate_boards, as (n, n_ships, n_words) uint64."""
+    n_rows, n_cols = board_sizes
+    n_words = -(-n_rows * n_cols // 64)
+
+    fleets = np.asarray(fleets, dtype=np.int64)
+    rows, cols, verticals = fleets[..., 0], fleets[..., 1], fleets[..., 2]
+
+    bits = np.zeros((len(fleets), len(ship_sizes), n_words * 64), dtype=bool)
+    fleet_index, ship_index = np.indices(rows.shape)
+
+    for k in range(max(ship_sizes)):
+        part = np.asarray(ship_sizes) > k
+        cells = (rows + k * verticals) * n_cols + cols + k * (1 - verticals)
+        bits[fleet_index[:, part], ship_index[:, part], cells[:, part]] = True
+
+    return np.packbits(bits, axis=2, bitorder="little").view("<u8")
+
+
+def write_corpus(path: str, fleets, board_sizes, ship_sizes, append: bool = False) -> int:
+    """Write fleets from generate_boards as a corpus file, or append them to one. Returns the fleet count."""
+    n_rows, n_cols = board_sizes
+    masks = fleet_masks(fleets, board_sizes, ship_sizes)
+
+    n_fleets = len(masks)
+    if append:
+        n_fleets += FleetCorpus(path).n_fleets
+
+    header = np.array([(VERSION, n_rows, n_cols, len(ship_sizes), masks.shape[2], n_fleets)],
+                      dtype=HEADER_FIELDS)
+    sizes = np.zeros(_header_size(len(ship_sizes)) - len(MAGIC) - HEADER_FIELDS.itemsize, dtype=np.uint8)
+    sizes[:len(ship_sizes)] = ship_sizes
+
+    with open(path, "r+b" if append else "wb") as f:
+        f.write(MAGIC + header.tobytes() + sizes.tobytes())
+        f.seek(0, 2)
+        f.write(masks.tobytes())
+
+    return n_fleets
+
+
+def build_corpus(path: str, board_sizes, ship_sizes, n_fleets: int, seed=None,
+                 uniform: bool = False, chunk_size: int = 100_000) -> int:
+    """Generate n_fleets fleets in chunks and store them at path."""
+    rng = np.random.default_rng(seed)
+
+    written = 0
+    while written < n_fleets:
+        n = min(chunk_size, n_fleets - written)
+        fleets = generate_boards(board_sizes, ship_sizes, n, uniform=uniform,
+                                 seed=rng.integers(2**63))
+        written = write_corpus(path, fleets, board_sizes, ship_sizes, append=written > 0)
+
+    return written
+
+
+class FleetCorpus:
+    """Memory-mapped corpus of fleets stored as fixed width bit-packed records.
+
+    Every record holds one uint64 word mask per ship, bit r * n_cols + c
+    set for the cells of the ship, the ship sizes are in the header. All
+    processes opening the same file share its pages.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, "rb") as f:
+            head = f.read(len(MAGIC) + HEADER_FIELDS.itemsize)
+            if head[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a fleet corpus")
+
+            header = np.frombuffer(head[len(MAGIC):], dtype=HEADER_FIELDS)[0]
+            if header["version"] != VERSION:
+                raise ValueError(f"unsupported corpus version {header['version']}")
+
+            self.board_sizes = int(header["n_rows"]), int(header["n_cols"])
+            self.n_fleets = int(header["n_fleets"])
+            n_ships, n_words = int(header["n_ships"]), int(header["n_words"])
+
+            self.ship_sizes = list(np.frombuffer(f.read(n_ships), dtype=np.uint8).tolist())
+
+        self.masks = np.memmap(path, dtype="<u8", mode="r", offset=_header_size(n_ships),
+                               shape=(self.n_fleets, n_ships, n_words))
+
+    def __len__(self):
+        return self.n_fleets
+
+    def oracle(self, index: int) -> "ShotOracle":
+        return ShotOracle(self.masks[index], self.board_sizes[1])
+
+    def test_board(self, index: int) -> list[set]:
+        """The fleet as a test board, a list of ship cell sets."""
+        n_cells = self.board_sizes[0] * self.board_sizes[1]
+        bits = np.unpackbits(self.masks[index].view(np.uint8), axis=1, bitorder="little")[:, :n_cells]
+
+        return [{divmod(int(cell), self.board_sizes[1]) for cell in np.flatnonzero(ship)}
+                for ship in bits]
+
+
+class ShotOracle:
+    """Answers shots at one fleet of a corpus with bitmask tests on its record.
+
+    Only the shot cells are kept per game, the record itself is never
+    copied. Can stand in for a test board in Board.test_game.
+    """
+
+    def __init__(self, masks: np.ndarray, n_cols: int):
+        self.masks = masks
+        self.n_cols = n_cols
+        self.reset()
+
+    def reset(self):
+        self.shots = np.zeros(self.masks.shape[1], dtype=np.uint64)
+
+    def shoot(self, shot) -> int:
+        """Return Board.MISS, Board.HIT or Board.SUNK for the shot at (row, col)."""
+        word, bit = divmod(shot[0] * self.n_cols + shot[1], 64)
+        bit = np.uint64(1) << np.uint64(bit)
+
+        ships = np.flatnonzero(self.masks[:, word] & bit)
+        if len(ships) == 0:
+            return Board.MISS
+
+        self.shots[word] |= bit
+
+        if (self.masks[ships[0]] & ~self.shots).any():
+            return Board.HIT
+        return Board.SUNK
+
+
+if __name__ == "__main__":
+
+    from example_ussage import BOARD_SIZES, SHIP_SIZES
+
+    parser = argparse.ArgumentParser(description="Build a fleet corpus file.")
+    parser.add_argument("n_fleets", type=int)
+    parser.add_argument("--output", default="fleets.corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--uniform", action="store_true")
+    args = parser.parse_args()
+
+    n_fleets = build_corpus(args.output, BOARD_SIZES, SHIP_SIZES, args.n_fleets,
+                            seed=args.seed, uniform=args.uniform)
+    print(f"stored {n_fleets} fleets in {args.output}")
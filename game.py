@@ -1,12 +1,87 @@
 
-from collections import defaultdict, deque
+from collections import OrderedDict, defaultdict, deque
+from functools import lru_cache
 from itertools import combinations
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import random
 import math
 import re
 import copy
 import time
+import profiling
+
+
+class TranspositionTable:
+
+    # bounded LRU map from (board state, remaining ships, k_max) to the
+    # probability map, shared by the boards of many games. only maps are
+    # kept, ties are drawn by the game, so games stay reproducible
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_bytes=64 * 2**20):
+
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(board, ship_sizes, k_max=0):
+        # the shape and the engine are part of the key, boards of different
+        # dimensions can have the same cell bytes
+        return repr((board.shape, k_max, sorted(ship_sizes))).encode() + board.tobytes()
+
+    def get(self, board, ship_sizes, k_max=0):
+
+        key = TranspositionTable.key(board, ship_sizes, k_max)
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, board, ship_sizes, probability_map, k_max=0):
+
+        key = TranspositionTable.key(board, ship_sizes, k_max)
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        self._entries[key] = probability_map
+        self.n_bytes += self.entry_bytes(key, probability_map)
+
+        # least recently used first
+        while self.n_bytes > self.max_bytes and self._entries:
+            old_key, old_map = self._entries.popitem(last=False)
+            self.n_bytes -= self.entry_bytes(old_key, old_map)
+            self.evictions += 1
+
+    def entry_bytes(self, key, probability_map):
+        return len(key) + probability_map.nbytes + TranspositionTable.ENTRY_OVERHEAD
+
+    def stats(self):
+
+        lookups = self.hits + self.misses
+
+        return {
+            "entries": len(self._entries),
+            "bytes": self.n_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
 
 
 class Board:
@@ -17,15 +92,43 @@ class Board:
     HIT = 2
     SUNK = 3
 
-    def __init__(self, board_sizes: tuple[int], ship_sizes: list[int]):
+    # first guess of the density cost per I-E-P term without overlap
+    # corrections, refined by measuring. with corrections the cost grows by
+    # orders of magnitude with k_max, so there is no guess for them
+    SECONDS_PER_IEP_TERM = 0.002
+
+    def __init__(self, board_sizes: tuple[int], ship_sizes: list[int], incremental: bool = True,
+                 probability_cache=None, opening_book=None, transposition_table=None,
+                 k_max=0):
 
         self.board_sizes = board_sizes
         self.ship_sizes = ship_sizes
+        self.incremental = incremental
+        # ship pairs allowed to overlap in the N_p correction, None for all
+        self.k_max = k_max
+        # optional probability_cache.ProbabilityCache shared between processes
+        self.probability_cache = probability_cache
+        # optional opening_book.OpeningBook with the shots of the first moves
+        self.opening_book = opening_book
+        # optional TranspositionTable with the maps of seen states
+        self.transposition_table = transposition_table
+        # shot from the book for the current map
+        self._known_shot = None
+        # optional profiling.Profiler recording every round of a game
+        self.profiler = None
 
         n_rows, n_cols = self.board_sizes
 
         self.board = np.zeros((n_rows, n_cols), dtype=np.uint8)
 
+        self.reset_placement_state()
+
+        # measured density cost per I-E-P term, by k_max
+        self.seconds_per_IEP_term = {0: Board.SECONDS_PER_IEP_TERM}
+        self.probability_stage = None
+        self.probability_errors = None
+        self.shot_confidence = None
+
     def get_padding(self, ship_coords):
 
         n_rows, n_cols = self.board_sizes
@@ -52,37 +155,76 @@ class Board:
 
         return any(self.board[coord] == Board.UNKNOWN for coord in ship_coords)
 
-    def get_placements(self):
+    @profiling.phase("get_placement_array")
+    def get_placement_array(self):
 
+        # all legal placements as rows of (ship size, row, col, vertical),
+        # ordered by size, then start cell, horizontal before vertical
         n_rows, n_cols = self.board_sizes
 
-        placements = []
+        blocked = ((self.board == Board.MISS) |
+                   (self.board == Board.SUNK)).astype(np.int32)
+        hit = (self.board == Board.HIT).astype(np.int32)
+        unknown = (self.board == Board.UNKNOWN).astype(np.int32)
 
-        avail_coords = zip(*np.where((self.board == Board.UNKNOWN)
-                                     | (self.board == Board.HIT)))
+        # hit or sunk cells, padded so every ship has a full 1 cell border
+        touched = np.pad(hit + (self.board == Board.SUNK), 1)
 
-        avail_coords = [(int(r), int(c)) for r, c in avail_coords]
+        placement_arrays = []
 
-        for ss in sorted(list(set(self.ship_sizes))):
+        for ss in sorted(set(self.ship_sizes)):
 
-            for s_row, s_col in avail_coords:
+            starts = []
 
-                if s_col + ss <= n_cols:
+            for vertical, axis in ((0, 1), (1, 0)):
 
-                    ship_coords = set([(s_row, c)
-                                       for c in range(s_col, s_col + ss)])
-                    if self.valid_placement(ship_coords):
-                        placements.append(ship_coords)
+                if ss > self.board_sizes[axis]:
+                    continue
+
+                def window_sum(mask):
+                    return sliding_window_view(mask, ss, axis=axis).sum(axis=-1)
+
+                # hit or sunk count in the ship plus padding box
+                box = (ss + 2, 3) if vertical else (3, ss + 2)
+                box_touched = sliding_window_view(
+                    touched, box).sum(axis=(-2, -1))
+
+                # the padding may not contain hits, only the ship itself
+                valid = ((window_sum(blocked) == 0) &
+                         (box_touched == window_sum(hit)) &
+                         (window_sum(unknown) > 0))
+
+                rows, cols = np.nonzero(valid)
+                starts.append(np.column_stack(
+                    (rows, cols, np.full(len(rows), vertical))))
+
+            starts = np.concatenate(starts) if starts else np.empty(
+                (0, 3), dtype=np.int64)
+            order = np.argsort(
+                (starts[:, 0] * n_cols + starts[:, 1]) * 2 + starts[:, 2], kind="stable")
 
-                if s_row + ss <= n_rows:
+            placement_arrays.append(np.column_stack(
+                (np.full(len(starts), ss), starts[order])))
+
+        if not placement_arrays:
+            return np.empty((0, 4), dtype=np.int64)
+
+        return np.concatenate(placement_arrays).astype(np.int64)
+
+    @profiling.phase("get_placements")
+    def get_placements(self):
+
+        placements = []
 
-                    ship_coords = set([(r, s_col)
-                                       for r in range(s_row, s_row + ss)])
-                    if self.valid_placement(ship_coords):
-                        placements.append(ship_coords)
+        for ss, row, col, vertical in self.get_placement_array().tolist():
+            if vertical:
+                placements.append({(r, col) for r in range(row, row + ss)})
+            else:
+                placements.append({(row, c) for c in range(col, col + ss)})
 
         return placements
 
+    @profiling.phase("get_hit_groups")
     def get_hit_groups(self):
 
         # get hit cells
@@ -120,101 +262,262 @@ class Board:
 
         return hit_groups
 
-    def get_hg_IEP_data(self, placements):
+    def get_placement_cells(self, placements):
+
+        # placement x cell incidence of the ship cells and of the ship cells
+        # plus their padding, cells flattened row major
+        n_rows, n_cols = self.board_sizes
+        sizes, rows, cols, verticals = placements.T
+
+        ship_cells = np.zeros((len(placements), n_rows, n_cols), dtype=bool)
+        for k in range(int(sizes.max(initial=0))):
+            part = np.flatnonzero(sizes > k)
+            ship_cells[part, rows[part] + k * verticals[part],
+                       cols[part] + k * (1 - verticals[part])] = True
+
+        # dilate every ship by one cell in all 8 directions
+        padded = np.pad(ship_cells, ((0, 0), (1, 1), (1, 1)))
+        padded_cells = np.zeros_like(ship_cells)
+        for r in range(3):
+            for c in range(3):
+                padded_cells |= padded[:, r:r + n_rows, c:c + n_cols]
+
+        return (ship_cells.reshape(len(placements), n_rows * n_cols),
+                padded_cells.reshape(len(placements), n_rows * n_cols))
+
+    def get_overlaps(self, ship_cells, padded_cells):
+
+        # overlaps[i, j] is True if placement j touches placement i or its
+        # padding, which is symmetric and True on the diagonal
+        return (padded_cells.astype(np.float32) @ ship_cells.T.astype(np.float32)) > 0
+
+    def valid_placement_mask(self, ship_cells, padded_cells):
+
+        # valid_placement for rows of an incidence matrix
+        flat_board = self.board.ravel()
+
+        blocked = (flat_board == Board.MISS) | (flat_board == Board.SUNK)
+        touched = (flat_board == Board.HIT) | (flat_board == Board.SUNK)
+        unknown = flat_board == Board.UNKNOWN
+
+        return (~(ship_cells & blocked).any(axis=1) &
+                ~(padded_cells & ~ship_cells & touched).any(axis=1) &
+                (ship_cells & unknown).any(axis=1))
+
+    def reset_placement_state(self):
+
+        # placements, their incidences and overlaps, kept alive between turns
+        # when running incrementally, see update_placement_state
+        self._placements = None
+        self._ship_cells = None
+        self._padded_cells = None
+        self._overlaps = None
+        self._alive = None
+        self._synced_board = None
+        self._free_counts = None
+        self._minimal_mask = None
+        self._minimal_mask_size = None
+
+    @profiling.phase("build_placement_state")
+    def build_placement_state(self):
+
+        placements = self.get_placement_array()
+        ship_cells, padded_cells = self.get_placement_cells(placements)
+
+        self._placements = placements
+        self._ship_cells = ship_cells
+        self._padded_cells = padded_cells
+        self._overlaps = self.get_overlaps(ship_cells, padded_cells)
+        self._alive = np.ones(len(placements), dtype=bool)
+        self._synced_board = self.board.copy()
+        self._minimal_mask = None
+
+    @profiling.phase("update_placement_state")
+    def update_placement_state(self):
+
+        if (not self.incremental or self._placements is None or
+                not set(self.ship_sizes) <= set(self._placements[:, 0].tolist())):
+            self.build_placement_state()
+            return self._placements
+
+        changed = np.flatnonzero(self.board != self._synced_board)
+        old_values = self._synced_board.ravel()[changed]
+        new_values = self.board.ravel()[changed]
+
+        # cells only ever go from unknown to known and from hit to sunk, so
+        # placements can only get invalid. anything else needs a rebuild
+        if not np.all((old_values == Board.UNKNOWN) |
+                      ((old_values == Board.HIT) & (new_values == Board.SUNK))):
+            self.build_placement_state()
+            return self._placements
+
+        # only placements whose padded footprint saw a change need a recheck
+        candidates = np.flatnonzero(
+            self._alive & self._padded_cells[:, changed].any(axis=1))
+
+        self._alive[candidates] = self.valid_placement_mask(
+            self._ship_cells[candidates], self._padded_cells[candidates])
+
+        self._synced_board = self.board.copy()
+
+        return self._placements
+
+    @profiling.phase("get_hg_IEP_data")
+    def get_hg_IEP_data(self):
 
         data = []
 
         hit_groups = self.get_hit_groups()
 
+        # overlaps dont depend on the hit cells a term filters, so the free
+        # placement counts are computed once per turn and shared by all terms,
+        # each term only keeps the placements it filters out
+        alive = self.get_indices()
+        self._free_counts = {ss: len(alive[ss]) - self._overlaps[:, alive[ss]].sum(axis=1)
+                             for ss in alive}
+
+        n_cols = self.board_sizes[1]
+        hit_group_masks = [self._ship_cells[:, [r * n_cols + c for r, c in hit_group]].any(axis=1)
+                           for hit_group in hit_groups]
+
         # I-E-P for hit groups
         for k in range(len(hit_groups)+1):
 
             sign = (-1)**k
 
-            combs = combinations(hit_groups, k)
+            combs = combinations(hit_group_masks, k)
 
             for comb in combs:
 
-                hit_cells = {
-                    cell for hit_group in comb for cell in hit_group}
+                filtered = np.zeros(len(self._placements), dtype=bool)
+                for hit_group_mask in comb:
+                    filtered |= hit_group_mask
 
-                indices = self.get_indices(placements, hit_cells)
+                indices = {}
+                excluded = {}
+                for ss in alive:
+                    hit = filtered[alive[ss]]
+                    indices[ss] = alive[ss][~hit]
+                    excluded[ss] = alive[ss][hit]
 
-                # init overlaps
-                overlaps = {}
-                for ss1 in set(self.ship_sizes):
-                    for index in indices[ss1]:
-                        p1 = placements[index]
-                        padded_p1 = self.get_padding(p1).union(p1)
-                        for ss2 in set(self.ship_sizes):
-                            overlaps[index, ss2] = set()
-                            for index2 in indices[ss2]:
-                                p2 = placements[index2]
-                                if not padded_p1.isdisjoint(p2):
-                                    overlaps[index, ss2].add(index2)
+                data.append((sign, indices, excluded))
 
-                data.append((sign, indices, overlaps))
+        profiling.count("hit_groups", len(hit_groups))
+        profiling.count("IEP_terms", len(data))
+        for ss in alive:
+            profiling.count(f"placements[{ss}]", len(alive[ss]))
 
         return data
 
-    def get_indices(self, placements, filter=set()):
+    def get_indices(self, filter=set()):
 
-        indices = {}
+        n_rows, n_cols = self.board_sizes
 
-        for ss in set(self.ship_sizes):
-            indices[ss] = set()
+        # alive placements that dont overlap with filter, per ship size
+        keep = self._alive.copy()
+        if filter:
+            filter_cells = [r * n_cols + c for r, c in filter]
+            keep &= ~self._ship_cells[:, filter_cells].any(axis=1)
 
-        # go through placements_list check which placements dont overlap with filter and add indices
-        for index, p in enumerate(placements):
-            if p.isdisjoint(filter):
-                ss = len(p)
-                indices[ss].add(index)
+        sizes = self._placements[:, 0]
 
-        return indices
+        return {ss: np.flatnonzero(keep & (sizes == ss)) for ss in set(self.ship_sizes)}
 
-    def N_p(self, ss, index, indices, overlaps, k_max):
+    @profiling.phase("N_p")
+    def N_p(self, ss, index, indices, excluded, k_max, overlap_cache=None):
 
-        num = 1
+        # index may be a single placement index or an array of them
+        index = np.atleast_1d(index)
+
+        overlaps = self._overlaps
+
+        num = np.ones(len(index))
 
         r_ship_sizes = self.ship_sizes.copy()
         r_ship_sizes.remove(ss)
 
-        r_indices = {}
-
         for r_ss in set(r_ship_sizes):
 
             ss_c = r_ship_sizes.count(r_ss)
 
-            r_indices[r_ss] = indices[r_ss] - overlaps[index, r_ss]
+            # free among all alive placements minus the free ones filtered
+            n_free = self._free_counts[r_ss][index] - len(excluded[r_ss]) + \
+                overlaps[np.ix_(index, excluded[r_ss])].sum(axis=1)
 
-            num *= len(r_indices[r_ss]) ** ss_c
+            num *= n_free.astype(float) ** ss_c
 
         pairs = list(combinations(range(len(r_ship_sizes)), 2))
 
-        sign = 1
-        for k in range(1, k_max + 1):
+        if overlap_cache is None:
+            overlap_cache = {}
+
+        for i in range(len(index) if k_max > 0 else 0):
+
+            r_indices = {r_ss: indices[r_ss][~overlaps[index[i], indices[r_ss]]]
+                         for r_ss in set(r_ship_sizes)}
+
+            sign = 1
+            for k in range(1, k_max + 1):
 
-            sign *= -1
-            for comb in combinations(pairs, k):
+                sign *= -1
+                for comb in combinations(pairs, k):
 
-                ship_data = index, r_ship_sizes, r_indices, overlaps
+                    ship_data = index[i], r_ship_sizes, r_indices, overlaps
 
-                N_O_comb = get_amount_overlap_combinations(comb, ship_data)
+                    N_O_comb = get_amount_overlap_combinations(
+                        comb, ship_data, overlap_cache)
 
-                num += sign * N_O_comb
+                    num[i] += sign * N_O_comb
 
         return num
 
+    def cache_engine(self):
+
+        # maps with overlap corrections differ, so they get their own entries
+        return "density" if not self.k_max else f"density[k_max={self.k_max}]"
+
+    @profiling.phase("calculate_probability_density")
     def calculate_probability_density(self):
 
+        # a book of another k_max has maps and shots of other densities
+        if self.opening_book is not None and self.opening_book.k_max == self.k_max:
+            entry = self.opening_book.lookup(self.board, self.ship_sizes)
+            if entry is not None:
+                self._known_shot, self.probability_map = entry
+                self.probability_errors = None
+                self.probability_stage = "book"
+                return
+
+        if self.transposition_table is not None:
+            entry = self.transposition_table.get(self.board, self.ship_sizes, self.k_max)
+            if entry is not None:
+                self.probability_map = entry
+                self.probability_errors = None
+                self.probability_stage = "table"
+                return
+
+        if self.probability_cache is not None:
+            cached = self.probability_cache.get(
+                self.cache_engine(), self.board, self.ship_sizes)
+            if cached is not None:
+                self.probability_map = cached
+                self.probability_errors = None
+                self.probability_stage = "density"
+                return
+
+        start = time.monotonic()
+
         probability_map = np.ones(self.board_sizes)
 
-        placements = self.get_placements()
+        self.update_placement_state()
 
-        hg_IEP_data = self.get_hg_IEP_data(placements)
+        hg_IEP_data = self.get_hg_IEP_data()
 
-        k_max = (1 < len(self.ship_sizes) <= 1) * \
-            math.comb(len(self.ship_sizes), 2)
+        # overlap corrections of up to k_max ship pairs, None for all pairs
+        k_max = math.comb(len(self.ship_sizes), 2) if self.k_max is None else self.k_max
+
+        # overlap counts of a term, shared by its N_p calls of this turn
+        overlap_caches = [{} for _ in hg_IEP_data]
 
         for ss in set(self.ship_sizes):
 
@@ -222,14 +525,12 @@ class Board:
 
             ss_c = self.ship_sizes.count(ss)
 
-            for sign, indices, overlaps in hg_IEP_data:
-
-                for i, index in enumerate(indices[ss]):
+            for (sign, indices, excluded), overlap_cache in zip(hg_IEP_data, overlap_caches):
 
-                    N_p = self.N_p(ss, index, indices, overlaps, k_max)
+                N_p = self.N_p(ss, indices[ss], indices, excluded, k_max, overlap_cache)
 
-                    for coord in placements[index]:
-                        ss_probability_map[coord] += sign * N_p
+                ss_probability_map += sign * \
+                    (N_p @ self._ship_cells[indices[ss]]).reshape(self.board_sizes)
 
             # rescaling to 0 - 1 for density
             ss_probability_map *= ss/np.sum(ss_probability_map)
@@ -242,38 +543,247 @@ class Board:
         probability_map = 1 - probability_map
 
         self.probability_map = probability_map
+        self.probability_errors = None
+        self.probability_stage = "density"
+
+        # only maps computed here feed the cost estimate of
+        # refine_probability_density, cached ones would push it to 0
+        self.seconds_per_IEP_term[self.k_max] = (time.monotonic() - start) / len(hg_IEP_data)
+
+        if self.transposition_table is not None:
+            self.transposition_table.put(
+                self.board, self.ship_sizes, probability_map, self.k_max)
+
+        if self.probability_cache is not None:
+            self.probability_cache.put(
+                self.cache_engine(), self.board, self.ship_sizes, probability_map)
+
+    @profiling.phase("sample_probability_density")
+    def sample_probability_density(self, n_samples=10_000, target_error=None, batch_size=1_000, seed=None, deadline=None):
+
+        # monte carlo estimate of the probability map with standard errors.
+        # fleets are drawn by sequential importance sampling: ships are placed
+        # largest first, each uniformly among the placements not touching the
+        # ships placed so far, weighted by the product of the choice counts and
+        # rejected if a hit cell stays uncovered. stops after n_samples or once
+        # every unknown cell's standard error is below target_error. with a
+        # deadline (a time.monotonic() timestamp) no batch is started that
+        # would likely end after it
+        rng = np.random.default_rng(seed)
+
+        self.update_placement_state()
+        indices = self.get_indices()
+
+        # a ship without any placement leaves nothing to draw, no fleet fits
+        if any(len(indices[ss]) == 0 for ss in self.ship_sizes):
+            self.n_samples = 0
+            self.coarse_probability_density()
+            return self.probability_map, self.probability_errors
+
+        n_cells = self.board.size
+        hit_cells = (self.board == Board.HIT).ravel()
+        unknown = (self.board == Board.UNKNOWN).ravel()
+
+        ship_cells = {ss: self._ship_cells[indices[ss]] for ss in indices}
+        padded_cells = {ss: self._padded_cells[indices[ss]] for ss in indices}
+        ship_cells_T = {ss: ship_cells[ss].T.astype(np.float32) for ss in indices}
+
+        # weighted sums for the self normalized estimate and its variance
+        sum_w = sum_w2 = 0.0
+        sum_wx = np.zeros(n_cells)
+        sum_w2x = np.zeros(n_cells)
+
+        n_drawn = 0
+        probability_map = np.zeros(n_cells)
+        standard_errors = np.full(n_cells, np.inf)
+
+        batch_seconds = 0
+
+        while n_drawn < n_samples:
+
+            if deadline is not None and time.monotonic() + batch_seconds > deadline:
+                break
+
+            batch_start = time.monotonic()
+
+            batch = min(batch_size, n_samples - n_drawn)
+
+            blocked = np.zeros((batch, n_cells), dtype=bool)
+            covered = np.zeros((batch, n_cells), dtype=bool)
+            weights = np.ones(batch)
+
+            for ss in sorted(self.ship_sizes, reverse=True):
 
+                compatible = (blocked.astype(np.float32) @ ship_cells_T[ss]) == 0
+                counts = compatible.sum(axis=1)
+                weights *= counts
+
+                # uniform choice among the compatible placements of every row
+                choice = np.floor(rng.random(batch) * counts)
+                pick = np.argmax(np.cumsum(compatible, axis=1) > choice[:, None], axis=1)
+
+                blocked |= padded_cells[ss][pick]
+                covered |= ship_cells[ss][pick]
+
+            weights[(hit_cells & ~covered).any(axis=1)] = 0
+
+            sum_w += weights.sum()
+            sum_w2 += (weights ** 2).sum()
+            sum_wx += weights @ covered
+            sum_w2x += (weights ** 2) @ covered
+
+            n_drawn += batch
+
+            batch_seconds = time.monotonic() - batch_start
+
+            if sum_w == 0:
+                continue
+
+            probability_map = sum_wx / sum_w
+            variance = (sum_w2x * (1 - 2 * probability_map) +
+                        probability_map ** 2 * sum_w2) / sum_w ** 2
+            standard_errors = np.sqrt(np.maximum(variance, 0))
+
+            if target_error is not None and np.all(standard_errors[unknown] <= target_error):
+                break
+
+        self.n_samples = n_drawn
+
+        # without an accepted sample the estimate is all zeros, the coarse
+        # counts are the better map then
+        if sum_w == 0:
+            self.coarse_probability_density()
+            return self.probability_map, self.probability_errors
+
+        self.probability_map = probability_map.reshape(self.board_sizes)
+        self.probability_errors = standard_errors.reshape(self.board_sizes)
+        self.probability_stage = "sampled"
+
+        return self.probability_map, self.probability_errors
+
+    @profiling.phase("coarse_probability_density")
+    def coarse_probability_density(self):
+
+        # one pass over the alive placements: how many of every size cover a
+        # cell, with placements through open hit cells weighted up front
+        self.update_placement_state()
+        indices = self.get_indices()
+
+        hit_cells = (self.board == Board.HIT).ravel()
+
+        probability_map = np.ones(self.board.size)
+
+        for ss in set(self.ship_sizes):
+
+            ship_cells = self._ship_cells[indices[ss]]
+            weights = 1 + len(ship_cells) * (ship_cells & hit_cells).any(axis=1)
+
+            ss_probability_map = weights @ ship_cells
+            if ss_probability_map.sum() > 0:
+                ss_probability_map = ss_probability_map * \
+                    ss / ss_probability_map.sum()
+
+            probability_map *= np.clip(1 - ss_probability_map, 0, 1) ** \
+                self.ship_sizes.count(ss)
+
+        self.probability_map = (1 - probability_map).reshape(self.board_sizes)
+        self.probability_errors = None
+        self.probability_stage = "coarse"
+
+    def refine_probability_density(self, deadline):
+
+        # progressively refine the probability map until deadline, a
+        # time.monotonic() timestamp: coarse counts first, then the full
+        # density if its estimated cost fits, else sampling until the
+        # deadline. the density cant be interrupted, so without a measured
+        # cost for the k_max it is never started here
+        self.coarse_probability_density()
+
+        n_terms = 2 ** len(self.get_hit_groups())
+        seconds_per_IEP_term = self.seconds_per_IEP_term.get(self.k_max, math.inf)
+
+        if time.monotonic() + n_terms * seconds_per_IEP_term < deadline:
+            self.calculate_probability_density()
+            return
+
+        if time.monotonic() < deadline:
+            self.sample_probability_density(
+                n_samples=math.inf, batch_size=500, deadline=deadline)
+
+    def get_shot_confidence(self, shot, candidates):
+
+        # estimated chance no other candidate has a higher hit probability:
+        # 1 for the full density, 0 for the coarse counts and from the
+        # standard errors against the runner up for sampled maps
+        if self.probability_stage in (None, "density", "book", "table"):
+            return 1.0
+        if self.probability_errors is None:
+            return 0.0
+
+        others = [coord for coord in candidates if coord != shot]
+        if not others:
+            return 1.0
+
+        runner_up = max(others, key=lambda coord: self.probability_map[coord])
+
+        margin = self.probability_map[shot] - self.probability_map[runner_up]
+        error = math.hypot(
+            self.probability_errors[shot], self.probability_errors[runner_up])
+        if error == 0:
+            return 1.0 if margin > 0 else 0.5
+
+        return 0.5 * (1 + math.erf(margin / error / math.sqrt(2)))
+
+    @profiling.phase("get_minimal_mask")
     def get_minimal_mask(self):
 
+        # greedy cover of the placements of the smallest ship: repeatedly take
+        # the cell in the most uncovered placements. the cover is kept between
+        # turns, placements only disappear, so cells covering nothing anymore
+        # are dropped and the greedy only runs for uncovered placements
+        self.update_placement_state()
+
+        n_cols = self.board_sizes[1]
+
         ss = min(self.ship_sizes)
-        placements = [p for p in self.get_placements() if len(p) == ss]
+        incidence = self._ship_cells[self.get_indices()[ss]]
+
+        if self._minimal_mask is None or self._minimal_mask_size != ss:
+            mask = []
+        else:
+            mask = [cell for cell in self._minimal_mask if incidence[:, cell].any()]
+
+        uncovered = ~incidence[:, mask].any(axis=1)
+        counts = incidence[uncovered].sum(axis=0)
 
-        minimal_mask = set()
+        while counts.any():
 
-        while len(placements) > 0:
+            cell = int(np.argmax(counts))
+            mask.append(cell)
 
-            # get all coord counts from flattened choose one with highest count
-            flat = [coord for p in placements for coord in p]
-            m = 0
-            max_coord = None
-            for coord in flat:
-                c = flat.count(coord)
-                if c > m:
-                    m = c
-                    max_coord = coord
+            # placements covered by the new cell no longer count
+            covered = uncovered & incidence[:, cell]
+            counts -= incidence[covered].sum(axis=0)
+            uncovered &= ~covered
 
-            # add to minimal_mask
-            minimal_mask.add(max_coord)
+        self._minimal_mask = mask
+        self._minimal_mask_size = ss
 
-            # remove placements that got hit
-            for i in range(len(placements)-1, -1, -1):
-                p = placements[i]
-                if max_coord in p:
-                    placements.remove(p)
+        return {divmod(cell, n_cols) for cell in mask}
 
-        return minimal_mask
+    @profiling.phase("best_possible_shot")
+    def best_possible_shot(self, deadline=None):
 
-    def best_possible_shot(self):
+        # with a deadline (a time.monotonic() timestamp) the probability map
+        # is refined up to it first and the confidence of the choice is kept
+        # in shot_confidence
+        if deadline is not None:
+            self.refine_probability_density(deadline)
+
+        # the opening book already knows the shot
+        if self.probability_stage == "book":
+            self.shot_confidence = 1.0
+            return self._known_shot
 
         m = 0
         best_shots = []
@@ -288,6 +798,9 @@ class Board:
         adj_hit_cells = {(r+a, c+b) for (r, c) in hit_cells for (a, b)
                          in adj if 0 <= r+a < n_rows and 0 <= c+b < n_cols}
 
+        candidates = [coord for coord in minimal_mask.union(adj_hit_cells)
+                      if self.board[coord] == Board.UNKNOWN]
+
         for coord in minimal_mask.union(adj_hit_cells):
             cell_value = self.board[coord]
             if self.probability_map[coord] > m and cell_value == Board.UNKNOWN:
@@ -313,7 +826,65 @@ class Board:
         # best_shots = [best_shots[i] for i in range(
         #     len(best_shots)) if n_list[i] == max(n_list)]
 
-        return random.choice(best_shots)
+        shot = random.choice(best_shots)
+
+        if deadline is not None:
+            self.shot_confidence = self.get_shot_confidence(shot, candidates)
+
+        return shot
+
+    @profiling.profiled_turn
+    def recommend_shot(self):
+
+        # one round: the probability map and the best shot for it, None once
+        # all ships are sunk. recorded as one turn if a profiler is set
+        self.calculate_probability_density()
+
+        if len(self.ship_sizes) == 0:
+            return None
+
+        return self.best_possible_shot()
+
+    def get_sunk_group(self, cell):
+
+        # the hit group cell closes when it is reported as SUNK
+        n_rows, n_cols = self.board_sizes
+
+        group = {tuple(cell)}
+        queue = deque(group)
+
+        while queue:
+            r, c = queue.popleft()
+            for a, b in [(0, 1), (0, -1), (1, 0), (-1, 0)]:
+                neighbor = (r+a, c+b)
+                if 0 <= r+a < n_rows and 0 <= c+b < n_cols and neighbor not in group \
+                        and self.board[neighbor] == Board.HIT:
+                    group.add(neighbor)
+                    queue.append(neighbor)
+
+        return group
+
+    def check_board_value(self, cell, value):
+
+        # raises ValueError if the shot result cant be applied, before
+        # update_board_value changes any cell
+        n_rows, n_cols = self.board_sizes
+
+        row, col = cell
+
+        if value not in (Board.MISS, Board.HIT, Board.SUNK):
+            raise ValueError(f"unknown value {value}")
+
+        if not (0 <= row < n_rows and 0 <= col < n_cols):
+            raise ValueError(f"cell {row} {col} is out of range")
+
+        if self.board[row, col] != Board.UNKNOWN:
+            raise ValueError(f"cell {row} {col} is already known")
+
+        if value == Board.SUNK:
+            size = len(self.get_sunk_group(cell))
+            if size not in self.ship_sizes:
+                raise ValueError(f"no ship of size {size} is left")
 
     def update_board_value(self, cell, value):
 
@@ -321,6 +892,10 @@ class Board:
 
         row, col = cell
 
+        # the map and a known shot belong to the previous state
+        self.probability_stage = None
+        self._known_shot = None
+
         if value == Board.MISS:
             self.board[row, col] = Board.MISS
 
@@ -334,6 +909,11 @@ class Board:
 
         elif value == Board.SUNK:
 
+            # checked first, so an impossible sink leaves the board unchanged
+            size = len(self.get_sunk_group(cell))
+            if size not in self.ship_sizes:
+                raise ValueError(f"no ship of size {size} is left")
+
             self.update_board_value(cell, Board.HIT)
 
             hit_groups = self.get_hit_groups()
@@ -402,9 +982,8 @@ class Board:
         n_rows, n_cols = self.board_sizes
 
         while True:
-            self.calculate_probability_density()
+            best_shot = self.recommend_shot()
             k += 1
-            best_shot = self.best_possible_shot()
             print("\nRound num:", k)
             print(self)
             print(self.ship_sizes)
@@ -442,13 +1021,25 @@ class Board:
             if len(self.ship_sizes) == 0:
                 break
 
-    def test_game(self, test_board, verbose=2):
+    def test_game(self, test_board, verbose=2, turn_times=None):
+
+        # verbose < 0 plays silently, turn_times collects seconds per round
 
         start_time = time.time()
 
-        board = Board(self.board_sizes, self.ship_sizes.copy())
+        board = Board(self.board_sizes, self.ship_sizes.copy(), self.incremental,
+                      self.probability_cache, self.opening_book, self.transposition_table,
+                      self.k_max)
+        board.profiler = self.profiler
 
-        _test_board = copy.deepcopy(test_board)
+        # a fleet_corpus.ShotOracle answers shots itself, lists of ships are
+        # copied because get_shot_value removes the cells it hits
+        if hasattr(test_board, "shoot"):
+            test_board.reset()
+            get_value = test_board.shoot
+        else:
+            _test_board = copy.deepcopy(test_board)
+            def get_value(shot): return get_shot_value(_test_board, shot)
 
         k = 0
 
@@ -456,13 +1047,13 @@ class Board:
 
             start = time.time()
 
-            board.calculate_probability_density()
+            shot = board.recommend_shot()
             k += 1
 
             if verbose == 0:
                 print("Round num:", k, end="\r")
 
-            else:
+            elif verbose > 0:
                 print("\n Round num", k)
 
             if verbose > 1:
@@ -477,14 +1068,12 @@ class Board:
                           time.time() - start_time} seconds")
                 return k
 
-            shot = board.best_possible_shot()
-
             value = board.board[shot[0], shot[1]]
             if value != Board.UNKNOWN:
                 print("Already known")
                 break
 
-            value = get_shot_value(_test_board, shot)
+            value = get_value(shot)
 
             board.update_board_value(shot, value)
 
@@ -499,6 +1088,9 @@ class Board:
                 print("Remaining ships:", board.ship_sizes)
                 print("Hit groups:", len(board.get_hit_groups()))
 
+            if turn_times is not None:
+                turn_times.append(time.time() - start)
+
             if verbose > 0:
                 print(f"round took {time.time() - start} seconds")
 
@@ -541,28 +1133,20 @@ def print_placement(placement, board_sizes):
 
 def get_average_round_num(board, test_board, N):
 
-    average = 0
-    mx = 0
-    mn = math.prod(board.board_sizes)
-
-    print("\n")
-    for i in range(N):
-
-        took = board.test_game(test_board, verbose=0)
-        average += took
+    from simulation import simulate_games
 
-        if took > mx:
-            mx = took
-        if took < mn:
-            mn = took
+    # the settings of board, every worker opens its own cache, book and table
+    results = simulate_games(
+        board.board_sizes, board.ship_sizes, n_games=N, test_boards=[test_board],
+        cache_directory=board.probability_cache.directory if board.probability_cache else None,
+        book_path=board.opening_book.path if board.opening_book else None,
+        table_bytes=board.transposition_table.max_bytes if board.transposition_table else None,
+        k_max=board.k_max)
 
-        print("\033[2K", end="\r")
-        print("\x1b[A", end="\r")
-        print("\033[2K", end="\r")
+    stats = results["rounds_stats"]
+    print(f"{N} average: {round(stats['mean'], 4)}, max: {stats['max']}, min: {stats['min']}")
 
-        print(f"{i+1} average: {round(average/(i+1), 4)}, max: {mx}, min: {mn}")
-
-    return average/N
+    return stats["mean"]
 
 
 def build_adjacency_list(pairs):
@@ -587,6 +1171,7 @@ def bfs(start, adj_list, visited):
     return component
 
 
+@profiling.phase("group_tuples")
 def group_tuples(pairs):
     adj_list = build_adjacency_list(pairs)
     visited = set()
@@ -606,87 +1191,113 @@ def group_tuples(pairs):
     return grouped_tuples
 
 
-def pairs_overlap_recursion(ship_data, group, done_ships):
+@lru_cache(maxsize=2**16)
+def comb_structure(r_ship_sizes, comb):
+
+    # the connected pair groups of comb with their ships relabeled in order
+    # of first appearance, as (ship sizes, edges), and the counts of the
+    # ship sizes in no pair. equal groups of different combs get equal keys
+    groups = []
+    for group in group_tuples(list(comb)):
+        labels = {}
+        for pair in group:
+            for ship in pair:
+                labels.setdefault(ship, len(labels))
+
+        sizes = tuple(r_ship_sizes[ship] for ship in labels)
+        edges = tuple(sorted((min(labels[i], labels[j]), max(labels[i], labels[j]))
+                             for i, j in group))
+        groups.append((sizes, edges))
 
-    i, j = group[0]
+    paired = {ship for pair in comb for ship in pair}
+    free_placing_ship_sizes = [ss for ship, ss in enumerate(r_ship_sizes) if ship not in paired]
+    free = tuple((ss, free_placing_ship_sizes.count(ss)) for ss in set(free_placing_ship_sizes))
 
+    return tuple(groups), free
+
+
+@profiling.phase("pairs_overlap_recursion")
+def pairs_overlap_recursion(ship_data, sizes, edges):
+
+    # number of placements of the group ships, ship t of size sizes[t], that
+    # overlap along every edge. iterative depth first search over the ships
+    # in order, the last two ships are counted in bulk
     index, r_ship_sizes, indices, overlaps = ship_data
 
-    # if both i and j in done ships validate overlap and move on or break
-    if i in done_ships and j in done_ships:
-        indexi = done_ships[i]
-        indexj = done_ships[j]
-        ss_j = r_ship_sizes[j]
-        if indexj in overlaps[indexi, ss_j]:
-            if len(group) == 1:
-                return 1
-            return pairs_overlap_recursion(
-                ship_data, group[1:], done_ships)
-        return 0
-
-    # elif both are not done already loop over all indices for first and overlap indices for second
-    elif i not in done_ships and j not in done_ships:
-
-        num = 0
-        ss_i = r_ship_sizes[i]
-        ss_j = r_ship_sizes[j]
-        if len(group) == 1:
-            for indexi in indices[ss_i]:
-                num += len(overlaps[indexi, ss_j] - overlaps[index, ss_j])
-            return num
-        for indexi in indices[ss_i]:
-            for indexj in overlaps[indexi, ss_j] - overlaps[index, ss_j]:
-                _done_ships = done_ships.copy()
-                _done_ships[i] = indexi
-                _done_ships[j] = indexj
-                num += pairs_overlap_recursion(ship_data,
-                                               group[1:], _done_ships)
-        return num
+    n_ships = len(sizes)
+    before = [[u for u, v in edges if v == t] for t in range(n_ships)]
 
-    # else just one in done ships loop over overlaps from other
-    elif i in done_ships:
-        indexi = done_ships[i]
-        ss_j = r_ship_sizes[j]
-        if len(group) == 1:
-            return len(overlaps[indexi, ss_j] - overlaps[index, ss_j])
-        num = 0
-        for indexj in overlaps[indexi, ss_j] - overlaps[index, ss_j]:
-            _done_ships = done_ships.copy()
-            _done_ships[j] = indexj
-            num += pairs_overlap_recursion(ship_data, group[1:], _done_ships)
-        return num
+    assigned = [None] * n_ships
 
-    else:
-        indexj = done_ships[j]
-        ss_i = r_ship_sizes[i]
-        if len(group) == 1:
-            return len(overlaps[indexj, ss_i] - overlaps[index, ss_i])
-        num = 0
-        for indexi in overlaps[indexj, ss_i] - overlaps[index, ss_i]:
-            _done_ships = done_ships.copy()
-            _done_ships[i] = indexi
-            num += pairs_overlap_recursion(ship_data, group[1:], _done_ships)
-        return num
+    def candidates(t, skip=None):
+        placements = indices[sizes[t]]
+        mask = np.ones(len(placements), dtype=bool)
+        for u in before[t]:
+            if u != skip:
+                mask &= overlaps[assigned[u], placements]
+        return placements[mask]
 
+    def count_last_two():
+        a, b = n_ships - 2, n_ships - 1
+        placements_a = candidates(a)
+        placements_b = candidates(b, skip=a)
+        if a in before[b]:
+            return int(overlaps[np.ix_(placements_a, placements_b)].sum())
+        return len(placements_a) * len(placements_b)
 
-def get_amount_overlap_combinations(comb, ship_data):
+    if n_ships == 2:
+        return count_last_two()
 
+    num = 0
+    nodes = 1
+    stack = [(0, candidates(0), 0)]
+
+    while stack:
+
+        t, placements, position = stack.pop()
+        if position == len(placements):
+            continue
+        stack.append((t, placements, position + 1))
+
+        assigned[t] = placements[position]
+        nodes += 1
+
+        if t + 1 == n_ships - 2:
+            num += count_last_two()
+        else:
+            stack.append((t + 1, candidates(t + 1), 0))
+
+    profiling.count("recursion_nodes", nodes)
+
+    return num
+
+
+@profiling.phase("get_amount_overlap_combinations")
+def get_amount_overlap_combinations(comb, ship_data, cache=None):
+
+    # cache maps (index, group sizes, group edges) to the group count and
+    # may be shared by all combs and indices of one I-E-P term
     index, r_ship_sizes, r_indices, overlaps = ship_data
 
+    groups, free = comb_structure(tuple(r_ship_sizes), tuple(comb))
+
     num = 1
 
-    groups = group_tuples(comb)
+    for sizes, edges in groups:
 
-    for group in groups:
-        factor = pairs_overlap_recursion(ship_data, group, {})
+        key = (index, sizes, edges)
+        if cache is not None and key in cache:
+            factor = cache[key]
+        else:
+            factor = pairs_overlap_recursion(ship_data, sizes, edges)
+            if cache is not None:
+                cache[key] = factor
 
         num *= factor
+        if num == 0:
+            return 0
 
-    free_placing_ship_sizes = [obj for i, obj in enumerate(
-        r_ship_sizes) if i not in {index for tup in comb for index in tup}]
-
-    for ss in set(free_placing_ship_sizes):
-        ss_c = free_placing_ship_sizes.count(ss)
+    for ss, ss_c in free:
         num *= len(r_indices[ss])**ss_c
 
     return num
@@ -0,0 +1,144 @@
+import argparse
+import random
+
+import numpy as np
+
+from game import Board
+
+
+class OpeningBook:
+    """Precomputed shots for the first moves of a game.
+
+    The book maps a board state and the remaining ship sizes to the shot
+    best_possible_shot chose there, together with the probability map at low
+    precision for display. The file is only read on the first lookup.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries = None
+        self._k_max = None
+
+    @staticmethod
+    def _key(board, ship_sizes) -> bytes:
+        # boards of different dimensions can have the same cell bytes
+        board = np.asarray(board, dtype=np.uint8)
+        return repr((board.shape, sorted(map(int, ship_sizes)))).encode() + board.tobytes()
+
+    def _load(self):
+        with np.load(self.path) as data:
+            boards = data["boards"].reshape(-1, *data["board_sizes"])
+            ship_sizes = data["ship_sizes"]
+            shots = data["shots"]
+            maps = data["maps"]
+            # books from before k_max was stored were built with 0, -1 is None
+            k_max = int(data["k_max"]) if "k_max" in data else 0
+
+        self._k_max = None if k_max < 0 else k_max
+
+        self._entries = {}
+        for board, sizes, shot, probability_map in zip(boards, ship_sizes, shots, maps):
+            key = self._key(board, sizes[sizes > 0])
+            self._entries[key] = (int(shot[0]), int(shot[1])), probability_map
+
+    @property
+    def k_max(self):
+        """The k_max of the Board the maps were computed with."""
+        if self._entries is None:
+            self._load()
+        return self._k_max
+
+    def lookup(self, board, ship_sizes):
+        """Return the shot and probability map stored for the state or None."""
+        if self._entries is None:
+            self._load()
+
+        entry = self._entries.get(self._key(board, ship_sizes))
+        if entry is None:
+            return None
+
+        shot, probability_map = entry
+        return shot, probability_map.astype(float).reshape(np.shape(board))
+
+    def __len__(self):
+        if self._entries is None:
+            self._load()
+        return len(self._entries)
+
+
+def build_opening_book(board_sizes, ship_sizes, depth: int, path: str, seed: int = 0, k_max=0) -> int:
+    """Expand the shot decision tree for depth moves and store it at path.
+
+    Every reachable MISS, HIT and SUNK answer is followed, answers no ship
+    placement allows are pruned. Ties in best_possible_shot are broken by
+    random seeded with seed, so one build always gives the same book.
+    The maps are computed with k_max, boards only use the book with the same
+    k_max. Returns the number of stored states.
+    """
+    random.seed(seed)
+
+    boards, sizes, shots, maps = [], [], [], []
+
+    def expand(board, moves_left):
+
+        board.calculate_probability_density()
+        if not np.isfinite(board.probability_map).all():
+            return
+
+        shot = board.best_possible_shot()
+
+        boards.append(board.board.ravel().copy())
+        sizes.append(sorted(board.ship_sizes, reverse=True))
+        shots.append(shot)
+        maps.append(board.probability_map.ravel().astype(np.float16))
+
+        if moves_left == 1:
+            return
+
+        for value in [Board.MISS, Board.HIT, Board.SUNK]:
+
+            # no placement covers the cell
+            if value != Board.MISS and board.probability_map[shot] <= 0:
+                continue
+
+            child = Board(board.board_sizes, board.ship_sizes.copy(), board.incremental, k_max=k_max)
+            child.board = board.board.copy()
+
+            try:
+                child.update_board_value(shot, value)
+            except ValueError:
+                # sunk hit group of a size that is not left
+                continue
+
+            if len(child.ship_sizes) > 0:
+                expand(child, moves_left - 1)
+
+    expand(Board(board_sizes, list(ship_sizes), k_max=k_max), depth)
+
+    n_ships = len(ship_sizes)
+    np.savez_compressed(
+        path,
+        board_sizes=np.array(board_sizes, dtype=np.int64),
+        k_max=np.array(-1 if k_max is None else k_max, dtype=np.int64),
+        boards=np.array(boards, dtype=np.uint8),
+        ship_sizes=np.array([s + [0] * (n_ships - len(s)) for s in sizes], dtype=np.uint8),
+        shots=np.array(shots, dtype=np.uint8),
+        maps=np.array(maps, dtype=np.float16),
+    )
+
+    return len(boards)
+
+
+if __name__ == "__main__":
+
+    from example_ussage import BOARD_SIZES, SHIP_SIZES
+
+    parser = argparse.ArgumentParser(description="Build an opening book for the first moves.")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--output", default="opening_book.npz")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k-max", type=int, default=0)
+    args = parser.parse_args()
+
+    n_states = build_opening_book(BOARD_SIZES, SHIP_SIZES, args.depth, args.output, args.seed, args.k_max)
+    print(f"stored {n_states} states in {args.output}")
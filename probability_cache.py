@@ -0,0 +1,120 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from symmetry import apply_symmetry, board_symmetries
+
+
+class ProbabilityCache:
+    """On-disk cache of probability maps, shared by any number of processes.
+
+    Entries are keyed on the engine, the board size, the remaining ship sizes
+    and the board state in its canonical orientation under the board
+    symmetries, so rotated and mirrored states share one entry. Maps are
+    stored as .npy files and opened memory-mapped. The least recently used
+    entries are evicted once the directory grows beyond max_bytes, down to
+    LOW_WATER of it so the directory scan is only needed now and then.
+    """
+
+    LOW_WATER = 0.9
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # bytes in the directory as of the last scan plus the puts since,
+        # None until the first put scans it
+        self.n_bytes = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _canonical(self, cells) -> tuple[bytes, np.ndarray]:
+        """Return the canonical state bytes and the symmetry mapping the state onto it."""
+        cells = np.asarray(cells, dtype=np.uint8)
+        n_rows, n_cols = cells.shape
+
+        canonical = None
+        for image in board_symmetries(n_rows, n_cols):
+            state = apply_symmetry(cells, image).tobytes()
+            if canonical is None or state < canonical[0]:
+                canonical = state, image
+
+        return canonical
+
+    def _path(self, engine: str, board_sizes, ship_sizes, state: bytes) -> str:
+        key = "|".join([
+            engine,
+            "x".join(map(str, board_sizes)),
+            ",".join(map(str, sorted(ship_sizes))),
+            state.hex(),
+        ])
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def get(self, engine: str, cells, ship_sizes) -> np.ndarray | None:
+        """Return the cached map for the state or None, read only and memory-mapped if no rotation is needed."""
+        cells = np.asarray(cells, dtype=np.uint8)
+        state, image = self._canonical(cells)
+        path = self._path(engine, cells.shape, ship_sizes, state)
+
+        try:
+            canonical_map = np.load(path, mmap_mode="r")
+            # a hit counts as a use for the eviction order
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        if np.array_equal(image, np.arange(cells.size)):
+            return canonical_map.reshape(cells.shape)
+        return canonical_map.ravel()[image].reshape(cells.shape)
+
+    def put(self, engine: str, cells, ship_sizes, probability_map) -> None:
+        """Store the map of the state in canonical orientation and evict old entries if needed."""
+        cells = np.asarray(cells, dtype=np.uint8)
+        state, image = self._canonical(cells)
+        path = self._path(engine, cells.shape, ship_sizes, state)
+
+        canonical_map = apply_symmetry(np.asarray(probability_map, dtype=float), image)
+
+        # write and rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, canonical_map)
+        os.replace(tmp_path, path)
+
+        # other processes sharing the directory are only seen by the scans
+        if self.n_bytes is not None:
+            self.n_bytes += os.path.getsize(path)
+
+        if self.n_bytes is None or self.n_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Scan the directory and remove the least recently used entries if it exceeds max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npy"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes * ProbabilityCache.LOW_WATER:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+        self.n_bytes = total
@@ -0,0 +1,175 @@
+import cProfile
+import contextlib
+import functools
+import heapq
+import os
+import time
+from collections import Counter
+
+
+# stats of the turn being profiled, None while nothing is profiled
+_active = None
+
+
+class TurnStats:
+    """Wall time and call counts per phase and problem size counters of one turn.
+
+    Phase times are inclusive, a phase calling another one contains its
+    time. Recursive phases are timed at the outermost call only but every
+    call is counted, so their call count is the number of recursion nodes.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.times = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self._depth = Counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "seconds": self.seconds,
+            "times": dict(self.times),
+            "calls": dict(self.calls),
+            "counters": dict(self.counters),
+        }
+
+
+class Profiler:
+    """Opt-in instrumentation of the density and exact engines.
+
+    Set as the profiler attribute of a game.Board or testing.Board. Every
+    round of test_game and start_game and every analyze call then records a
+    TurnStats in turns. With profile_slowest the turns also run under
+    cProfile and the profiles of that many slowest turns are kept for
+    dump_profiles. Without a profiler the instrumented functions only check
+    a module variable.
+    """
+
+    def __init__(self, profile_slowest: int = 0):
+        self.profile_slowest = profile_slowest
+        self.turns = []
+        self._slowest = []
+
+    @contextlib.contextmanager
+    def turn(self):
+        global _active
+
+        stats = TurnStats()
+        previous, _active = _active, stats
+
+        profile = cProfile.Profile() if self.profile_slowest else None
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+
+        try:
+            yield stats
+
+        finally:
+            if profile is not None:
+                profile.disable()
+            stats.seconds = time.perf_counter() - start
+            _active = previous
+
+            self.turns.append(stats)
+
+            if profile is not None:
+                heapq.heappush(self._slowest, (stats.seconds, len(self.turns) - 1, profile))
+                if len(self._slowest) > self.profile_slowest:
+                    heapq.heappop(self._slowest)
+
+    def summary(self) -> dict:
+        """Phase times, calls and counters summed over all turns."""
+        return Profiler.merge([{
+            "turns": 1,
+            "seconds": turn.seconds,
+            "max_seconds": turn.seconds,
+            "times": dict(turn.times),
+            "calls": dict(turn.calls),
+            "counters": dict(turn.counters),
+        } for turn in self.turns])
+
+    @staticmethod
+    def merge(summaries) -> dict:
+        """Combine summaries, for example of the games of a simulation."""
+        times, calls, counters = Counter(), Counter(), Counter()
+        turns, seconds, max_seconds = 0, 0.0, 0.0
+
+        for summary in summaries:
+            turns += summary["turns"]
+            seconds += summary["seconds"]
+            max_seconds = max(max_seconds, summary["max_seconds"])
+            times.update(summary["times"])
+            calls.update(summary["calls"])
+            counters.update(summary["counters"])
+
+        return {
+            "turns": turns,
+            "seconds": seconds,
+            "max_seconds": max_seconds,
+            "times": dict(times.most_common()),
+            "calls": dict(calls),
+            "counters": dict(counters),
+        }
+
+    def dump_profiles(self, directory: str) -> list[str]:
+        """Write the cProfile output of the slowest turns as turn_<index>.prof files, slowest first."""
+        os.makedirs(directory, exist_ok=True)
+
+        paths = []
+        for seconds, index, profile in sorted(self._slowest, reverse=True):
+            path = os.path.join(directory, f"turn_{index}.prof")
+            profile.dump_stats(path)
+            paths.append(path)
+
+        return paths
+
+
+def phase(name: str):
+    """Decorator recording the wall time and calls of a function as phase name."""
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _active
+            if stats is None:
+                return func(*args, **kwargs)
+
+            stats.calls[name] += 1
+            if stats._depth[name]:
+                return func(*args, **kwargs)
+
+            stats._depth[name] += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.times[name] += time.perf_counter() - start
+                stats._depth[name] -= 1
+
+        return wrapper
+
+    return decorator
+
+
+def profiled_turn(method):
+    """Decorator running a method as one turn of the profiler attribute of its object, if set."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # calls inside a running turn belong to it
+        if self.profiler is None or _active is not None:
+            return method(self, *args, **kwargs)
+
+        with self.profiler.turn():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def count(name: str, n: int = 1):
+    """Add n to the counter name of the running turn."""
+    if _active is not None:
+        _active.counters[name] += n
@@ -0,0 +1,192 @@
+import random
+from collections import Counter, defaultdict
+from itertools import combinations
+
+import numpy as np
+
+from game import Board
+
+
+class BatchRecommender:
+    """Recommend shots for many game states at once.
+
+    The placements of every ship size of the fleet, their cells and their
+    overlaps are built once for the empty board and shared by all states.
+    States are grouped by their remaining ships and each group is evaluated
+    with matrix products over all its states and I-E-P terms together,
+    giving the same probability maps as Board.calculate_probability_density.
+    Unlike a Board, the minimal mask is computed fresh for every call.
+    """
+
+    def __init__(self, board_sizes: tuple[int, int], ship_sizes: list[int], seed=None):
+
+        self.board_sizes = tuple(board_sizes)
+        self.ship_sizes = list(ship_sizes)
+        self.rng = random.Random(seed)
+
+        empty = Board(self.board_sizes, self.ship_sizes.copy())
+
+        self.placements = empty.get_placement_array()
+        self.sizes = self.placements[:, 0]
+        self.ship_cells, padded_cells = empty.get_placement_cells(self.placements)
+        self.overlaps = empty.get_overlaps(self.ship_cells, padded_cells)
+
+        # float32 copies for the matrix products, counts stay exact
+        self._ship_cells_t = self.ship_cells.T.astype(np.float32)
+        self._border_cells_t = (padded_cells & ~self.ship_cells).T.astype(np.float32)
+        self._overlaps = self.overlaps.astype(np.float32)
+
+    def alive_mask(self, boards: np.ndarray) -> np.ndarray:
+        """Board.valid_placement_mask for a (states, cells) array of flat boards."""
+        blocked = ((boards == Board.MISS) | (boards == Board.SUNK)).astype(np.float32)
+        touched = ((boards == Board.HIT) | (boards == Board.SUNK)).astype(np.float32)
+        unknown = (boards == Board.UNKNOWN).astype(np.float32)
+
+        return ((blocked @ self._ship_cells_t == 0) &
+                (touched @ self._border_cells_t == 0) &
+                (unknown @ self._ship_cells_t > 0))
+
+    def _IEP_terms(self, boards: np.ndarray, alive: np.ndarray):
+
+        # one row per state and I-E-P term over the hit groups of the state:
+        # the placements the term keeps and its sign
+        keep, signs, owners = [], [], []
+
+        for b, board in enumerate(boards):
+
+            hit_board = Board(self.board_sizes, [])
+            hit_board.board = board.reshape(self.board_sizes)
+
+            n_cols = self.board_sizes[1]
+            hit_group_masks = [self.ship_cells[:, [r * n_cols + c for r, c in hit_group]].any(axis=1)
+                               for hit_group in hit_board.get_hit_groups()]
+
+            for k in range(len(hit_group_masks) + 1):
+                for comb in combinations(hit_group_masks, k):
+
+                    filtered = np.zeros(len(self.placements), dtype=bool)
+                    for hit_group_mask in comb:
+                        filtered |= hit_group_mask
+
+                    keep.append(alive[b] & ~filtered)
+                    signs.append((-1)**k)
+                    owners.append(b)
+
+        # sums the signed rows of every state
+        combine = np.zeros((len(boards), len(keep)))
+        combine[owners, np.arange(len(keep))] = signs
+
+        return np.array(keep), combine
+
+    def probability_maps(self, boards: np.ndarray, ship_sizes: list[int]) -> np.ndarray:
+        """Probability maps of (states, cells) flat boards sharing the remaining ship_sizes."""
+        counts = Counter(ship_sizes)
+
+        alive = self.alive_mask(boards) & np.isin(self.sizes, list(counts))
+        keep, combine = self._IEP_terms(boards, alive)
+
+        # free placements of every size per term and placement, see Board.N_p
+        n_free = {}
+        for r_ss in counts:
+            kept = keep[:, self.sizes == r_ss].astype(np.float32)
+            n_free[r_ss] = (kept.sum(axis=1, keepdims=True) -
+                            kept @ self._overlaps[self.sizes == r_ss]).astype(float)
+
+        probability = np.ones(boards.shape)
+
+        for ss, ss_c in counts.items():
+
+            columns = self.sizes == ss
+
+            N_p = keep[:, columns].astype(float)
+            for r_ss, r_ss_c in counts.items():
+                exponent = r_ss_c - (r_ss == ss)
+                if exponent:
+                    N_p *= n_free[r_ss][:, columns] ** exponent
+
+            ss_probability = combine @ (N_p @ self.ship_cells[columns])
+
+            # rescaling to 0 - 1 for density
+            ss_probability *= ss / ss_probability.sum(axis=1, keepdims=True)
+            probability *= (1 - ss_probability) ** ss_c
+
+        return 1 - probability
+
+    def minimal_masks(self, alive: np.ndarray, ss: int) -> np.ndarray:
+        """Board.get_minimal_mask for all states at once, as (states, cells) bool."""
+        incidence = self.ship_cells[self.sizes == ss]
+        incidence_f = incidence.astype(np.float32)
+
+        uncovered = alive[:, self.sizes == ss].copy()
+        counts = uncovered.astype(np.float32) @ incidence_f
+
+        masks = np.zeros(counts.shape, dtype=bool)
+
+        while (counts > 0).any():
+
+            active = counts.max(axis=1) > 0
+            cells = np.argmax(counts, axis=1)
+            masks[active, cells[active]] = True
+
+            covered = uncovered & incidence[:, cells].T
+            covered[~active] = False
+
+            counts -= covered.astype(np.float32) @ incidence_f
+            uncovered &= ~covered
+
+        return masks
+
+    def _choose_shots(self, boards: np.ndarray, probability_maps: np.ndarray, masks: np.ndarray):
+
+        n_rows, n_cols = self.board_sizes
+
+        # cells next to hit cells
+        hit = (boards == Board.HIT).reshape(-1, n_rows, n_cols)
+        adjacent = np.zeros_like(hit)
+        adjacent[:, 1:] |= hit[:, :-1]
+        adjacent[:, :-1] |= hit[:, 1:]
+        adjacent[:, :, 1:] |= hit[:, :, :-1]
+        adjacent[:, :, :-1] |= hit[:, :, 1:]
+
+        candidates = (masks | adjacent.reshape(len(boards), -1)) & (boards == Board.UNKNOWN)
+
+        shots = []
+        for b in range(len(boards)):
+            values = np.where(candidates[b], probability_maps[b], -np.inf)
+            best_shots = np.flatnonzero(np.abs(values - values.max()) < 0.1**10)
+            shots.append(divmod(int(self.rng.choice(best_shots.tolist())), n_cols))
+
+        return shots
+
+    def recommend_many(self, states, return_maps: bool = False):
+        """Return a shot for every (board cells, remaining ship sizes) state.
+
+        States without remaining ships get None. With return_maps the
+        probability maps are returned as well, None where there is no shot.
+        """
+        states = list(states)
+
+        shots = [None] * len(states)
+        maps = [None] * len(states)
+
+        groups = defaultdict(list)
+        for i, (cells, ship_sizes) in enumerate(states):
+            if len(ship_sizes) > 0:
+                groups[tuple(sorted(ship_sizes, reverse=True))].append(i)
+
+        for ship_sizes, members in groups.items():
+
+            boards = np.array([np.asarray(states[i][0], dtype=np.uint8).ravel() for i in members])
+
+            probability_maps = self.probability_maps(boards, list(ship_sizes))
+            alive = self.alive_mask(boards)
+            masks = self.minimal_masks(alive, min(ship_sizes))
+
+            for i, shot, probability_map in zip(
+                    members, self._choose_shots(boards, probability_maps, masks), probability_maps):
+                shots[i] = shot
+                maps[i] = probability_map.reshape(self.board_sizes)
+
+        if return_maps:
+            return shots, maps
+        return shots
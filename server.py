@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from game import Board
+from simulation import summarize
+
+
+VALUES = {"miss": Board.MISS, "hit": Board.HIT, "sunk": Board.SUNK}
+
+# boards kept per worker process, so consecutive turns of a session that
+# land on the same worker update the placements incrementally
+WORKER_BOARDS = 64
+
+_worker_boards = OrderedDict()
+
+
+def _recommend(session_id, board_sizes, cells, ship_sizes, with_map):
+
+    board = _worker_boards.pop(session_id, None)
+    if board is None or board.board.shape != tuple(board_sizes):
+        board = Board(tuple(board_sizes), list(ship_sizes))
+
+    _worker_boards[session_id] = board
+    while len(_worker_boards) > WORKER_BOARDS:
+        _worker_boards.popitem(last=False)
+
+    board.board = cells
+    board.ship_sizes = list(ship_sizes)
+
+    board.calculate_probability_density()
+    shot = board.best_possible_shot()
+
+    probability_map = board.probability_map.tolist() if with_map else None
+
+    return [int(shot[0]), int(shot[1])], probability_map
+
+
+class Session:
+
+    def __init__(self, board_sizes, ship_sizes):
+        # only the cells and the remaining ships, the density runs in the pool
+        self.board = Board(tuple(board_sizes), list(ship_sizes))
+        self.lock = asyncio.Lock()
+
+
+class GameServer:
+    """Newline delimited JSON service keeping many game sessions alive.
+
+    Every request is one JSON object per line with an "op" and an optional
+    "id" that is echoed in the response. Requests of one connection are
+    handled concurrently, requests of one session in order. Density
+    calculations run in a process pool, everything else in the event loop.
+
+        {"op": "new", "board_sizes": [10, 10], "ship_sizes": [6, 4, ...]}
+        {"op": "shot", "session": 1, "map": false}
+        {"op": "update", "session": 1, "cell": [3, 4], "value": "hit"}
+        {"op": "close", "session": 1}
+        {"op": "metrics"}
+    """
+
+    def __init__(self, processes: int = None, max_latencies: int = 10_000):
+        self.pool = ProcessPoolExecutor(processes)
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.latencies = defaultdict(lambda: deque(maxlen=max_latencies))
+
+    async def op_new(self, request):
+        board_sizes = request.get("board_sizes", [10, 10])
+        ship_sizes = request["ship_sizes"]
+
+        session_id = next(self.session_ids)
+        self.sessions[session_id] = Session(board_sizes, ship_sizes)
+
+        return {"session": session_id}
+
+    async def op_shot(self, request):
+        session_id, session = self.get_session(request)
+
+        async with session.lock:
+            board = session.board
+            if not board.ship_sizes:
+                raise ValueError("all ships are sunk")
+
+            shot, probability_map = await asyncio.get_running_loop().run_in_executor(
+                self.pool, _recommend, session_id, board.board_sizes,
+                board.board.copy(), board.ship_sizes.copy(), bool(request.get("map")))
+
+        response = {"shot": shot}
+        if probability_map is not None:
+            response["map"] = probability_map
+        return response
+
+    async def op_update(self, request):
+        _, session = self.get_session(request)
+
+        value = VALUES.get(str(request["value"]).lower())
+        if value is None:
+            raise ValueError(f"unknown value {request['value']!r}")
+
+        row, col = request["cell"]
+
+        async with session.lock:
+            board = session.board
+            # rejected updates leave the session unchanged
+            board.check_board_value((row, col), value)
+            board.update_board_value((row, col), value)
+
+        return {"ship_sizes": board.ship_sizes, "done": not board.ship_sizes}
+
+    async def op_close(self, request):
+        session_id, _ = self.get_session(request)
+        del self.sessions[session_id]
+        return {}
+
+    async def op_metrics(self, request):
+        return {
+            "sessions": len(self.sessions),
+            "latency": {op: summarize(list(times)) | {"count": len(times)}
+                        for op, times in self.latencies.items()},
+        }
+
+    def get_session(self, request):
+        session_id = request.get("session")
+        if session_id not in self.sessions:
+            raise KeyError(f"unknown session {session_id!r}")
+        return session_id, self.sessions[session_id]
+
+    async def handle_request(self, line: bytes) -> dict:
+
+        start = time.perf_counter()
+        request = {}
+        op = None
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                request = {}
+                raise ValueError("a request must be a JSON object")
+
+            op = request.get("op")
+            handler = getattr(self, f"op_{op}", None)
+            if handler is None:
+                raise ValueError(f"unknown op {op!r}")
+
+            response = {"ok": True} | await handler(request)
+
+        except Exception as error:
+            response = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+
+        if "id" in request:
+            response["id"] = request["id"]
+
+        self.latencies[op if op is not None else "invalid"].append(time.perf_counter() - start)
+
+        return response
+
+    async def handle_connection(self, reader, writer):
+
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(line):
+            response = await self.handle_request(line)
+            async with write_lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks)
+
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, unix_path: str = None):
+
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Serve battleship shot recommendations as NDJSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this unix socket instead of TCP")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    server = GameServer(args.processes)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
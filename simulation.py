@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import random
+
+import numpy as np
+from tqdm import tqdm
+
+from game import Board, TranspositionTable
+from example_ussage import generate_board
+from fleet_corpus import FleetCorpus
+from opening_book import OpeningBook
+from probability_cache import ProbabilityCache
+from profiling import Profiler
+
+
+def summarize(values) -> dict[str, float]:
+    """Mean, median, 95th percentile, max and min of a list of numbers."""
+    if len(values) == 0:
+        return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0, "min": 0.0}
+
+    values = np.asarray(values, dtype=float)
+
+    return {
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "max": float(values.max()),
+        "min": float(values.min()),
+    }
+
+
+# one transposition table per worker process, shared by all its games
+_transposition_table = None
+
+# corpora opened by the worker process, by path
+_corpora = {}
+
+
+def _play_game(args):
+    global _transposition_table
+
+    (board_sizes, ship_sizes, test_board, seed, cache_directory, book_path, table_bytes,
+     corpus_path, profile, k_max) = args
+
+    # every game reseeds, so results dont depend on which worker plays it
+    random.seed(seed)
+
+    if corpus_path is not None:
+        if corpus_path not in _corpora:
+            _corpora[corpus_path] = FleetCorpus(corpus_path)
+        test_board = _corpora[corpus_path].oracle(test_board)
+
+    elif test_board is None:
+        test_board = generate_board(board_sizes, ship_sizes)
+
+    probability_cache = ProbabilityCache(cache_directory) if cache_directory else None
+
+    opening_book = OpeningBook(book_path) if book_path else None
+
+    if table_bytes and _transposition_table is None:
+        _transposition_table = TranspositionTable(table_bytes)
+    transposition_table = _transposition_table if table_bytes else None
+
+    hits, misses = (transposition_table.hits, transposition_table.misses) \
+        if transposition_table is not None else (0, 0)
+
+    board = Board(board_sizes, ship_sizes.copy(), probability_cache=probability_cache,
+                  opening_book=opening_book, transposition_table=transposition_table, k_max=k_max)
+    board.profiler = Profiler() if profile else None
+    turn_times = []
+    rounds = board.test_game(test_board, verbose=-1, turn_times=turn_times)
+
+    if transposition_table is not None:
+        hits, misses = transposition_table.hits - hits, transposition_table.misses - misses
+
+    profile_summary = board.profiler.summary() if profile else None
+
+    return rounds, turn_times, (hits, misses), profile_summary
+
+
+def simulate_games(
+    board_sizes: tuple[int, int],
+    ship_sizes: list[int],
+    n_games: int = None,
+    test_boards: list = None,
+    seed: int = 0,
+    processes: int = None,
+    cache_directory: str = None,
+    book_path: str = None,
+    table_bytes: int = None,
+    corpus_path: str = None,
+    profile: bool = False,
+    k_max: int = 0,
+) -> dict:
+    """Play many games on a process pool and collect round counts and turn timings.
+
+    Games are played on the given test boards, cycling through them until n_games
+    are played, or on boards from generate_board if no test boards are given.
+    Every game gets its own seed drawn from seed, so results are reproducible.
+    With a cache_directory all workers share one on-disk ProbabilityCache,
+    with a book_path they play the first moves from an OpeningBook and with
+    table_bytes every worker keeps a TranspositionTable of that size.
+    With a corpus_path the fleets of a FleetCorpus are played in order instead
+    of test boards, all of them if n_games is not given. With profile the
+    per phase profiling.Profiler summaries of all games are merged. k_max is
+    passed on to every Board, None for the overlap corrections of all pairs.
+    """
+    if corpus_path is not None:
+        n_corpus = len(FleetCorpus(corpus_path))
+        n_games = n_corpus if n_games is None else n_games
+        test_boards = [i % n_corpus for i in range(n_games)]
+
+    if n_games is None:
+        if test_boards is None:
+            raise ValueError("either n_games or test_boards must be given")
+        n_games = len(test_boards)
+
+    rng = random.Random(seed)
+    seeds = [rng.getrandbits(32) for _ in range(n_games)]
+
+    args_list = [
+        (board_sizes, list(ship_sizes),
+         test_boards[i % len(test_boards)] if test_boards else None, seeds[i],
+         cache_directory, book_path, table_bytes, corpus_path, profile, k_max)
+        for i in range(n_games)
+    ]
+
+    with multiprocessing.Pool(processes or os.cpu_count()) as pool:
+        results = list(tqdm(pool.imap(_play_game, args_list), total=n_games, desc="Playing games"))
+
+    rounds = [r for r, _, _, _ in results]
+    turn_times = [t for _, t, _, _ in results]
+    table_hits = sum(hits for _, _, (hits, _), _ in results)
+    table_lookups = table_hits + sum(misses for _, _, (_, misses), _ in results)
+
+    return {
+        "seeds": seeds,
+        "rounds": rounds,
+        "turn_times": turn_times,
+        "rounds_stats": summarize(rounds),
+        "turn_time_stats": summarize([t for times in turn_times for t in times]),
+        "table_hit_rate": table_hits / table_lookups if table_lookups else 0.0,
+        "profile": Profiler.merge(p for _, _, _, p in results) if profile else None,
+    }
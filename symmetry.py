@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def board_symmetries(n_rows: int, n_cols: int) -> list[np.ndarray]:
+    """Return the dihedral symmetries of the board, 8 for square boards and 4 otherwise.
+
+    Every symmetry is an array mapping the flat index r * n_cols + c of a cell
+    to the flat index of its image. The identity always comes first.
+    """
+    cells = np.arange(n_rows * n_cols).reshape(n_rows, n_cols)
+
+    transformed = [cells, cells[::-1, ::-1], cells[::-1, :], cells[:, ::-1]]
+    if n_rows == n_cols:
+        transformed += [cells.T, cells.T[::-1, ::-1],
+                        np.rot90(cells), np.rot90(cells, -1)]
+
+    symmetries = []
+    for t in transformed:
+        image = np.empty(n_rows * n_cols, dtype=np.int64)
+        image[t.ravel()] = np.arange(n_rows * n_cols)
+        symmetries.append(image)
+
+    return symmetries
+
+
+def apply_symmetry(values, image: np.ndarray) -> np.ndarray:
+    """Move flat per cell values to the image cells of a symmetry."""
+    values = np.asarray(values).ravel()
+    result = np.empty_like(values)
+    result[image] = values
+    return result
+
+
+def preserved_symmetries(values, n_rows: int, n_cols: int) -> list[np.ndarray]:
+    """Return the symmetries of the board that map the per cell values onto themselves."""
+    values = np.asarray(values).ravel()
+    return [image for image in board_symmetries(n_rows, n_cols)
+            if np.array_equal(apply_symmetry(values, image), values)]
+
+
+def canonical_placements(placements: list, symmetries: list[np.ndarray]) -> dict[int, int]:
+    """Map the index of one placement per orbit to the size of its orbit.
+
+    placements are collections of flat cell indices, closed under the symmetries.
+    """
+    lookup = {frozenset(p): index for index, p in enumerate(placements)}
+
+    weights = {}
+    seen = set()
+    for index, p in enumerate(placements):
+        if index in seen:
+            continue
+        cells = np.fromiter(p, dtype=np.int64)
+        orbit = {lookup[frozenset(image[cells].tolist())] for image in symmetries}
+        seen |= orbit
+        weights[index] = len(orbit)
+
+    return weights
+
+
+def unfold(values, symmetries: list[np.ndarray]) -> np.ndarray:
+    """Average flat per cell values over the symmetries.
+
+    Summing orbit weighted results of one placement per orbit and unfolding
+    gives the same result as summing the results of all placements.
+    """
+    return sum(apply_symmetry(values, image) for image in symmetries) / len(symmetries)
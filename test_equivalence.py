@@ -0,0 +1,276 @@
+"""Equivalence checks of the optimized engines against slow references.
+
+Runs under pytest or as a script. Every check plays or builds small boards,
+so the whole module finishes in seconds.
+"""
+import copy
+import math
+import os
+import random
+import tempfile
+from itertools import combinations, product
+
+import numpy as np
+
+from example_ussage import BOARD_SIZES, SHIP_SIZES, fleet_to_test_board, generate_boards
+from fleet_corpus import FleetCorpus, ShotOracle, write_corpus
+from game import Board, get_shot_value
+from recommend import BatchRecommender
+import testing
+
+
+# 7x7 fleet of [4, 3, 2, 2] without touching ships
+FLEET = [
+    {(0, 0), (0, 1), (0, 2), (0, 3)},
+    {(2, 6), (3, 6), (4, 6)},
+    {(6, 0), (6, 1)},
+    {(3, 2), (4, 2)},
+]
+
+
+def reference_density(board: Board) -> np.ndarray:
+    """The probability map of the original coordinate set engine, without overlap corrections."""
+    n_rows, n_cols = board.board_sizes
+
+    placements = set()
+    for ss in set(board.ship_sizes):
+        for r in range(n_rows):
+            for c in range(n_cols):
+                for cells in ({(r, c + i) for i in range(ss)}, {(r + i, c) for i in range(ss)}):
+                    if all(0 <= row < n_rows and 0 <= col < n_cols for row, col in cells) and \
+                            board.valid_placement(cells):
+                        placements.add(frozenset(cells))
+
+    padded = {p: board.get_padding(p) | p for p in placements}
+    hit_groups = board.get_hit_groups()
+
+    probability_map = np.ones(board.board_sizes)
+
+    for ss in set(board.ship_sizes):
+
+        r_ship_sizes = board.ship_sizes.copy()
+        r_ship_sizes.remove(ss)
+
+        ss_probability_map = np.zeros(board.board_sizes)
+
+        # I-E-P over the hit groups no placement of a term covers
+        for k in range(len(hit_groups) + 1):
+            for comb in combinations(hit_groups, k):
+
+                filtered = {cell for hit_group in comb for cell in hit_group}
+                term = [p for p in placements if p.isdisjoint(filtered)]
+
+                for p in term:
+                    if len(p) != ss:
+                        continue
+
+                    N_p = 1
+                    for r_ss in set(r_ship_sizes):
+                        free = sum(1 for q in term if len(q) == r_ss and padded[p].isdisjoint(q))
+                        N_p *= free ** r_ship_sizes.count(r_ss)
+
+                    for cell in p:
+                        ss_probability_map[cell] += (-1) ** k * N_p
+
+        ss_probability_map *= ss / ss_probability_map.sum()
+        probability_map *= (1 - ss_probability_map) ** board.ship_sizes.count(ss)
+
+    return 1 - probability_map
+
+
+def test_density_matches_reference():
+    random.seed(0)
+
+    test_board = copy.deepcopy(FLEET)
+    boards = [Board((7, 7), [4, 3, 2, 2], incremental=incremental) for incremental in (True, False)]
+
+    while boards[0].ship_sizes:
+
+        expected = reference_density(boards[0])
+        for board in boards:
+            board.calculate_probability_density()
+            assert np.allclose(board.probability_map, expected, rtol=0, atol=1e-12)
+
+        shot = boards[0].best_possible_shot()
+        value = get_shot_value(test_board, shot)
+        for board in boards:
+            board.update_board_value(shot, value)
+
+
+def brute_force_N_p(board: Board, ss: int, index: int, indices: dict, k_max: int) -> int:
+    """N_p by enumerating the placements of the remaining ships, I-E-P over at most k_max overlapping pairs."""
+    overlaps = board._overlaps
+
+    r_ship_sizes = board.ship_sizes.copy()
+    r_ship_sizes.remove(ss)
+
+    r_indices = [indices[r_ss][~overlaps[index, indices[r_ss]]] for r_ss in r_ship_sizes]
+
+    # overlapping pairs of every combination of placements, one axis per ship
+    n_overlapping = np.zeros([len(r) for r in r_indices], dtype=int)
+    for i, j in combinations(range(len(r_ship_sizes)), 2):
+        shape = [1] * len(r_ship_sizes)
+        shape[i], shape[j] = len(r_indices[i]), len(r_indices[j])
+        n_overlapping = n_overlapping + overlaps[np.ix_(r_indices[i], r_indices[j])].reshape(shape)
+
+    # a combination with c overlapping pairs counts sum_k (-1)^k comb(c, k)
+    n_pairs = len(r_ship_sizes) * (len(r_ship_sizes) - 1) // 2
+    weights = [sum((-1) ** k * math.comb(c, k) for k in range(k_max + 1))
+               for c in range(n_pairs + 1)]
+
+    return int(np.take(weights, n_overlapping).sum())
+
+
+def test_N_p_matches_brute_force():
+    board = Board((6, 6), [3, 2, 2, 2])
+    for cell, value in [((2, 2), Board.HIT), ((0, 5), Board.MISS), ((4, 0), Board.MISS)]:
+        board.update_board_value(cell, value)
+
+    board.update_placement_state()
+
+    for sign, indices, excluded in board.get_hg_IEP_data():
+        for ss in set(board.ship_sizes):
+            for k_max in range(4):
+                N_p = board.N_p(ss, indices[ss], indices, excluded, k_max)
+                expected = [brute_force_N_p(board, ss, index, indices, k_max) for index in indices[ss]]
+                assert np.array_equal(N_p, expected)
+
+
+def exact_probability(board: Board) -> np.ndarray:
+    """Hit probability of every cell over all fleets consistent with the board, by enumeration."""
+    board.update_placement_state()
+    indices = board.get_indices()
+
+    ship_sizes = sorted(board.ship_sizes, reverse=True)
+    hit_cells = (board.board == Board.HIT).ravel()
+
+    total = np.zeros(board.board.size)
+    n_fleets = 0
+
+    def place(ship, blocked, covered):
+        nonlocal total, n_fleets
+
+        if ship == len(ship_sizes):
+            if not (hit_cells & ~covered).any():
+                total += covered
+                n_fleets += 1
+            return
+
+        for index in indices[ship_sizes[ship]]:
+            if not (board._ship_cells[index] & blocked).any():
+                place(ship + 1, blocked | board._padded_cells[index], covered | board._ship_cells[index])
+
+    place(0, np.zeros(board.board.size, dtype=bool), np.zeros(board.board.size, dtype=bool))
+
+    return (total / n_fleets).reshape(board.board_sizes)
+
+
+def test_sampler_matches_enumeration():
+    board = Board((6, 6), [3, 2, 2])
+    board.update_board_value((2, 2), Board.HIT)
+    board.update_board_value((0, 5), Board.MISS)
+
+    expected = exact_probability(board)
+    probability_map, errors = board.sample_probability_density(n_samples=50_000, seed=1)
+
+    # within five standard errors, cells all samples agree on exactly
+    assert np.all(np.abs(probability_map - expected) <= 5 * errors + 1e-12)
+
+
+def exact_engine_reference(board: testing.Board) -> np.ndarray:
+    """The normalized cell counts of testing.Board over all fleets of the board, by enumeration."""
+    ships = {}
+    for ship_size in set(board.ship_sizes):
+        placements = []
+        for r in range(board.height):
+            for c in range(board.width):
+                for cells in ([(r, c + i) for i in range(ship_size)], [(r + i, c) for i in range(ship_size)]):
+                    if all(row < board.height and col < board.width and
+                           board.cells[row][col] not in (testing.CellState.MISS, testing.CellState.SUNK)
+                           for row, col in cells):
+                        placements.append(cells)
+        ships[ship_size] = combinations(placements, board.ship_sizes.count(ship_size))
+
+    counts = np.zeros((board.height, board.width))
+    for fleet in product(*ships.values()):
+        cells = [cell for same_size in fleet for placement in same_size for cell in placement]
+        if len(set(cells)) == len(cells):
+            for cell in cells:
+                counts[cell] += 1
+
+    return counts * sum(board.ship_sizes) / counts.sum()
+
+
+def test_exact_engines_match_enumeration():
+    # a board with all symmetries, and a rectangular one a MISS leaves without any
+    symmetric = testing.Board(5, 5, [3, 2, 2])
+    asymmetric = testing.Board(5, 4, [3, 3, 2, 2])
+    asymmetric.edit_cell(1, 0, testing.CellState.MISS)
+
+    for board in (symmetric, asymmetric):
+        expected = exact_engine_reference(board)
+        for probability_board in (board.analyze(), board.analyze_counting(), board.analyze_parallel(processes=2)):
+            assert np.allclose(probability_board, expected, rtol=0, atol=1e-12)
+
+
+def test_recommend_many_matches_board():
+    random.seed(0)
+
+    # every state of a game, all evaluated in one batch afterwards
+    test_board = copy.deepcopy(FLEET)
+    board = Board((7, 7), [4, 3, 2, 2])
+    states, maps = [], []
+
+    while board.ship_sizes:
+        board.calculate_probability_density()
+        states.append((board.board.copy(), board.ship_sizes.copy()))
+        maps.append(board.probability_map.copy())
+
+        shot = board.best_possible_shot()
+        board.update_board_value(shot, get_shot_value(test_board, shot))
+
+    shots, batch_maps = BatchRecommender((7, 7), [4, 3, 2, 2], seed=0).recommend_many(states, return_maps=True)
+
+    for (cells, ship_sizes), shot, batch_map, expected in zip(states, shots, batch_maps, maps):
+        assert np.allclose(batch_map, expected, rtol=0, atol=1e-12)
+
+        # the batch shot is one of the best shots of the board
+        board = Board((7, 7), ship_sizes.copy())
+        board.board = cells.copy()
+        board.calculate_probability_density()
+        best = board.best_possible_shot()
+        assert abs(board.probability_map[shot] - board.probability_map[best]) < 0.1**10
+
+
+def test_shot_oracle_matches_get_shot_value():
+    fleets = generate_boards(BOARD_SIZES, SHIP_SIZES, 20, seed=0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fleets.corpus")
+        write_corpus(path, fleets, BOARD_SIZES, SHIP_SIZES)
+        corpus = FleetCorpus(path)
+        for i, fleet in enumerate(fleets):
+            assert corpus.test_board(i) == fleet_to_test_board(fleet, SHIP_SIZES)
+
+        # a copy, so the file can be removed with the directory
+        masks = np.array(corpus.masks)
+        del corpus
+
+    rng = random.Random(0)
+    cells = [(r, c) for r in range(10) for c in range(10)]
+
+    for fleet, fleet_masks in zip(fleets, masks):
+
+        # every cell once in random order, so HIT and SUNK answers both occur
+        oracle = ShotOracle(fleet_masks, BOARD_SIZES[1])
+        test_board = fleet_to_test_board(fleet, SHIP_SIZES)
+        rng.shuffle(cells)
+        for cell in cells:
+            assert oracle.shoot(cell) == get_shot_value(test_board, cell)
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_") and callable(check):
+            check()
+            print(f"{name} passed")
@@ -1,7 +1,13 @@
+import heapq
 import multiprocessing
+import os
 import timeit
+from collections import OrderedDict
 from enum import Enum, auto 
+import numpy as np
 from tqdm import tqdm
+import profiling
+from symmetry import canonical_placements, preserved_symmetries, unfold
 
 class CellState(Enum):
     UNKNOWN = auto()
@@ -9,30 +15,71 @@ class CellState(Enum):
     HIT = auto()
     SUNK = auto()
 
+class LRUMemo:
+    """Dict of at most max_entries items, the least recently used one is dropped first."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return value
+
+    def put(self, key, value) -> None:
+        self._entries[key] = value
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
 class Board:
+    # Subproblems analyze_counting keeps at most, about 1 KB each on a 10x10 board
+    MEMO_ENTRIES = 100_000
+
     def __init__(self, width: int, height: int, ship_sizes: list[int]):
         self.width = width
         self.height = height
         self.ship_sizes = ship_sizes
         self.cells = [[CellState.UNKNOWN for _ in range(width)] for _ in range(height)]
+        # Optional probability_cache.ProbabilityCache shared between processes
+        self.probability_cache = None
+        # Optional profiling.Profiler, every analyze call is one turn
+        self.profiler = None
 
     def edit_cell(self, x: int, y: int, state: CellState) -> None:
         if 0 <= x < self.width and 0 <= y < self.height:
             self.cells[y][x] = state
     
+    @profiling.profiled_turn
     def analyze(self) -> list[list[float]]:
         """Analyze the board and return probability distribution for ship placements."""
-        probability_board = [[0 for _ in range(self.width)] for _ in range(self.height)]
+        if self.probability_cache is not None:
+            cached = self.probability_cache.get("exact", self._cell_values(), self.ship_sizes)
+            if cached is not None:
+                return cached.tolist()
         
         # Generate valid positions for each ship size
         positions = self._generate_valid_positions()
         
         # Generate bitmasks for efficient overlap checking
         bitmasks = self._generate_bitmasks(positions)
+        position_arrays = self._generate_position_arrays(positions)
         
-        # Calculate probabilities using recursive placement
+        # Only place the first ship at one position per symmetry orbit
         initial_remaining_ships = sorted(self.ship_sizes)[::-1]
-        for idx in tqdm(range(len(bitmasks[initial_remaining_ships[0]])), desc="Placing first ship"):
+        symmetries, weights = self._first_ship_orbits(positions, monotone=True)
+        
+        # Calculate probabilities using recursive placement, one board per orbit size
+        weighted_boards = {}
+        for idx in tqdm(weights, desc="Placing first ship"):
+            probability_board = weighted_boards.setdefault(
+                weights[idx], np.zeros((self.height, self.width), dtype=np.int64))
             bitmask = bitmasks[initial_remaining_ships[0]][idx]
             self._calculate_probabilities(
                 initial_remaining_ships[1:], 
@@ -41,12 +88,91 @@ class Board:
                 1, 
                 positions, 
                 bitmasks, 
-                probability_board
+                probability_board,
+                position_arrays
             )
         
+        probability_board = self._unfold_weighted_boards(weighted_boards, symmetries)
+        
         # Normalize probabilities
-        return self._normalize_probabilities(probability_board)
+        probability_board = self._normalize_probabilities(probability_board)
+        
+        if self.probability_cache is not None:
+            self.probability_cache.put("exact", self._cell_values(), self.ship_sizes, probability_board)
+        
+        return probability_board
     
+    @profiling.profiled_turn
+    def analyze_counting(self, memo_entries: int = None) -> list[list[float]]:
+        """Analyze the board like analyze, counting the completions of memoized subproblems instead of enumerating them.
+
+        At most memo_entries subproblems are kept, least recently used
+        first out, MEMO_ENTRIES by default.
+        """
+        positions = self._generate_valid_positions()
+        bitmasks = self._generate_bitmasks(positions)
+        position_arrays = self._generate_position_arrays(positions)
+        pair_arrays = self._generate_pair_arrays(position_arrays)
+
+        remaining_ships = tuple(sorted(self.ship_sizes)[::-1])
+        ship_size = remaining_ships[0]
+
+        # Place the first ship at one position per symmetry orbit, the ordered
+        # counts below it are symmetric for any multiplicity of its size
+        symmetries, weights = self._first_ship_orbits(positions, monotone=False)
+
+        memo = LRUMemo(Board.MEMO_ENTRIES if memo_entries is None else memo_entries)
+        cells = position_arrays[ship_size][1]
+        cell_counts = np.zeros(self.height * self.width, dtype=np.int64)
+        for idx, weight in weights.items():
+            sub_count, sub_cell_counts = self._count_completions(
+                remaining_ships[1:], bitmasks[ship_size][idx], bitmasks, position_arrays, pair_arrays, memo)
+            cell_counts += weight * (sub_cell_counts + sub_count * cells[idx])
+
+        profiling.count("memo_entries", len(memo))
+        profiling.count("memo_hits", memo.hits)
+
+        probability_board = unfold(cell_counts.astype(float), symmetries).reshape(self.height, self.width).tolist()
+
+        return self._normalize_probabilities(probability_board)
+
+    def _cell_values(self) -> list[list[int]]:
+        """Return the cell states as their integer values."""
+        return [[cell.value for cell in row] for row in self.cells]
+
+    @profiling.phase("_first_ship_orbits")
+    def _first_ship_orbits(
+        self,
+        positions: dict[int, list[list[tuple[int, int]]]],
+        monotone: bool
+    ) -> tuple[list[np.ndarray], dict[int, int]]:
+        """Find the symmetries the cells preserve and weight one first ship position per orbit by the orbit size."""
+        ship_size = max(self.ship_sizes)
+        placements = [[r * self.width + c for r, c in pos] for pos in positions[ship_size]]
+
+        symmetries = preserved_symmetries(self._cell_values(), self.height, self.width)
+
+        # With monotone indices for equal sizes the subtree of a first position
+        # depends on its index, so only a unique largest ship can be reduced
+        if monotone and self.ship_sizes.count(ship_size) > 1:
+            symmetries = symmetries[:1]
+
+        return symmetries, canonical_placements(placements, symmetries)
+
+    @profiling.phase("_unfold_weighted_boards")
+    def _unfold_weighted_boards(
+        self,
+        weighted_boards: dict[int, list[list[float]]],
+        symmetries: list[np.ndarray]
+    ) -> list[list[float]]:
+        """Sum boards weighted by their orbit size and unfold the sum over the symmetries."""
+        total = np.zeros((self.height, self.width))
+        for weight, board in weighted_boards.items():
+            total += weight * np.array(board, dtype=float)
+
+        return unfold(total, symmetries).reshape(self.height, self.width).tolist()
+
+    @profiling.phase("_generate_valid_positions")
     def _generate_valid_positions(self) -> dict[int, list[list[tuple[int, int]]]]:
         """Generate all valid positions for each ship size."""
         positions = {}
@@ -68,9 +194,12 @@ class Board:
                 pos = positions[ship_size][pos_index]
                 if any(self.cells[r][c] in [CellState.MISS, CellState.SUNK] for r, c in pos):
                     positions[ship_size].pop(pos_index)
+            
+            profiling.count(f"positions[{ship_size}]", len(positions[ship_size]))
         
         return positions
     
+    @profiling.phase("_generate_bitmasks")
     def _generate_bitmasks(self, positions: dict[int, list[list[tuple[int, int]]]]) -> dict[int, list[int]]:
         """Generate bitmasks for each valid position for efficient overlap checking."""
         bitmasks = {}
@@ -85,6 +214,114 @@ class Board:
         
         return bitmasks
     
+    @profiling.phase("_generate_position_arrays")
+    def _generate_position_arrays(
+        self,
+        positions: dict[int, list[list[tuple[int, int]]]]
+    ) -> dict[int, tuple[np.ndarray, np.ndarray]]:
+        """Generate 64 bit word masks and cell occupancy arrays of the positions for bulk overlap checks."""
+        n_words = (self.width * self.height + 63) // 64
+        position_arrays = {}
+        
+        for ship_size, pos_list in positions.items():
+            words = np.zeros((len(pos_list), n_words), dtype=np.uint64)
+            cells = np.zeros((len(pos_list), self.height * self.width), dtype=np.int64)
+            for pos_index, pos in enumerate(pos_list):
+                for r, c in pos:
+                    bit = r * self.width + c
+                    words[pos_index, bit // 64] |= np.uint64(1 << (bit % 64))
+                    cells[pos_index, bit] = 1
+            position_arrays[ship_size] = words, cells
+        
+        return position_arrays
+    
+    @staticmethod
+    def _mask_words(mask: int, n_words: int) -> np.ndarray:
+        """Split a bitmask into 64 bit words like _generate_position_arrays."""
+        return np.array([(mask >> (64 * k)) & 0xFFFFFFFFFFFFFFFF for k in range(n_words)], dtype=np.uint64)
+
+    @profiling.phase("_generate_pair_arrays")
+    def _generate_pair_arrays(
+        self,
+        position_arrays: dict[int, tuple[np.ndarray, np.ndarray]]
+    ) -> dict[tuple[int, int], np.ndarray]:
+        """Generate for every pair of ship sizes which of their positions do not overlap."""
+        pair_arrays = {}
+
+        for size_a, (words_a, _) in position_arrays.items():
+            for size_b, (words_b, _) in position_arrays.items():
+                pair_arrays[size_a, size_b] = ~(words_a[:, None, :] & words_b[None, :, :]).any(axis=2)
+
+        return pair_arrays
+
+    @profiling.phase("_count_completions")
+    def _count_completions(
+        self,
+        remaining_ships: tuple[int, ...],
+        current_mask: int,
+        bitmasks: dict[int, list[int]],
+        position_arrays: dict[int, tuple[np.ndarray, np.ndarray]],
+        pair_arrays: dict[tuple[int, int], np.ndarray],
+        memo: "LRUMemo"
+    ) -> tuple[int, np.ndarray]:
+        """Count the placements of remaining_ships compatible with current_mask and how often they occupy each cell."""
+        if not remaining_ships:
+            return 1, np.zeros(self.height * self.width, dtype=np.int64)
+
+        ship_size = remaining_ships[0]
+        words, cells = position_arrays[ship_size]
+        mask_words = self._mask_words(current_mask, words.shape[1])
+        compatible = np.flatnonzero(~(words & mask_words).any(axis=1))
+
+        # Last ship in bulk, like _calculate_probabilities
+        if len(remaining_ships) == 1:
+            return len(compatible), cells[compatible].sum(axis=0)
+
+        key = (remaining_ships, current_mask)
+        cached = memo.get(key)
+        if cached is not None:
+            return cached
+
+        if len(remaining_ships) == 2:
+            # Last two ships in bulk: every compatible position of the first
+            # completes with each compatible position of the second it
+            # does not overlap
+            other_size = remaining_ships[1]
+            other_words, other_cells = position_arrays[other_size]
+            other_compatible = np.flatnonzero(~(other_words & mask_words).any(axis=1))
+
+            pairs = pair_arrays[ship_size, other_size][np.ix_(compatible, other_compatible)]
+            n_others = pairs.sum(axis=1)
+
+            count = int(n_others.sum())
+            cell_counts = n_others @ cells[compatible] + pairs.sum(axis=0) @ other_cells[other_compatible]
+
+        else:
+            count = 0
+            cell_counts = np.zeros(self.height * self.width, dtype=np.int64)
+            for idx in compatible:
+                sub_count, sub_cell_counts = self._count_completions(
+                    remaining_ships[1:],
+                    current_mask | bitmasks[ship_size][idx],
+                    bitmasks,
+                    position_arrays,
+                    pair_arrays,
+                    memo
+                )
+                if sub_count:
+                    count += sub_count
+                    cell_counts += sub_cell_counts + sub_count * cells[idx]
+
+        # every completion was reached once per ship of this size placed
+        # first, the division is exact
+        multiplicity = remaining_ships.count(ship_size)
+        count //= multiplicity
+        cell_counts //= multiplicity
+
+        memo.put(key, (count, cell_counts))
+        return count, cell_counts
+
+    @profiling.phase("_calculate_probabilities")
     def _calculate_probabilities(
         self, 
         remaining_ships: list[int], 
@@ -93,7 +330,8 @@ class Board:
         depth: int,
         positions: dict[int, list[list[tuple[int, int]]]],
         bitmasks: dict[int, list[int]],
-        probability_board: list[list[float]]
+        probability_board: list[list[float]],
+        position_arrays: dict[int, tuple[np.ndarray, np.ndarray]] = None
     ) -> None:
         """Recursively calculate probabilities for all valid ship configurations."""
         if not remaining_ships:
@@ -121,6 +359,19 @@ class Board:
                 # Different size ship - can use any valid position
                 start_idx = 0
         
+        if len(remaining_ships) == 1 and position_arrays is not None:
+            # Last ship in bulk: test all its positions against the mask at
+            # once, add their cells and credit the placed ships per completion
+            words, cells = position_arrays[ship_size]
+            compatible = ~(words[start_idx:] & self._mask_words(current_mask, words.shape[1])).any(axis=1)
+            n_completions = int(compatible.sum())
+            if n_completions:
+                probability_board += cells[start_idx:][compatible].sum(axis=0).reshape(self.height, self.width)
+                for placed_size, idx in zip(self.ship_sizes, bitmask_indices):
+                    for r, c in positions[placed_size][idx]:
+                        probability_board[r][c] += n_completions
+            return
+        
         for idx in range(start_idx, len(bitmasks[ship_size])):
             bitmask = bitmasks[ship_size][idx]
             if current_mask & bitmask == 0:
@@ -132,9 +383,11 @@ class Board:
                     depth + 1,
                     positions,
                     bitmasks,
-                    probability_board
+                    probability_board,
+                    position_arrays
                 )
     
+    @profiling.phase("_normalize_probabilities")
     def _normalize_probabilities(self, probability_board: list[list[float]]) -> list[list[float]]:
         """Normalize probabilities so the total sum equals the number of ship cells."""
         total_hits = sum(self.ship_sizes)
@@ -158,42 +411,140 @@ class Board:
 
 
     @staticmethod
-    def _worker_task(args):
-        board_self, initial_ship_size, idx, positions, bitmasks, ship_sizes, width, height = args
-        probability_board = [[0 for _ in range(width)] for _ in range(height)]
+    def _init_worker(board_args, positions, bitmasks, position_arrays, ship_sizes):
+        """Keep the placement tables in the worker, so tasks only carry a first ship index."""
+        # a fresh board from the dimensions, the profiler and the cache of the
+        # parent are not picklable under the spawn start method
+        _worker_state["board"] = Board(*board_args)
+        _worker_state["positions"] = positions
+        _worker_state["bitmasks"] = bitmasks
+        _worker_state["position_arrays"] = position_arrays
+        _worker_state["ship_sizes"] = ship_sizes
 
-        bitmask = bitmasks[initial_ship_size][idx]
+    @staticmethod
+    def _worker_task(task):
+        bitmask_indices, current_mask, weight = task
+        board_self = _worker_state["board"]
+        positions = _worker_state["positions"]
+        bitmasks = _worker_state["bitmasks"]
+        position_arrays = _worker_state["position_arrays"]
+        ship_sizes = _worker_state["ship_sizes"]
+
+        probability_board = np.zeros((board_self.height, board_self.width), dtype=np.int64)
+
+        depth = len(bitmask_indices)
         board_self._calculate_probabilities(
-            ship_sizes[1:], bitmask, [idx], 1,
-            positions, bitmasks, probability_board
+            ship_sizes[depth:], current_mask, bitmask_indices, depth,
+            positions, bitmasks, probability_board, position_arrays
         )
-        return probability_board
+        return weight * probability_board.astype(float)
+
+    def _estimate_subtree_cost(self, ship_sizes: list[int], current_mask: int, bitmasks: dict[int, list[int]]) -> int:
+        """Estimate the leaves below a node as the product of the compatible position counts of the remaining ships."""
+        compatible = {
+            ship_size: sum(1 for bitmask in bitmasks[ship_size] if current_mask & bitmask == 0)
+            for ship_size in set(ship_sizes)
+        }
+        cost = 1
+        for ship_size in ship_sizes:
+            cost *= compatible[ship_size]
+        return cost
+
+    def _split_task(
+        self,
+        ship_sizes: list[int],
+        bitmask_indices: list[int],
+        current_mask: int,
+        bitmasks: dict[int, list[int]]
+    ) -> list[tuple[list[int], int]]:
+        """Place the next ship of a task in every valid position, exactly as _calculate_probabilities would."""
+        depth = len(bitmask_indices)
+        ship_size = ship_sizes[depth]
+
+        start_idx = 0
+        if self.ship_sizes[depth - 1] == ship_size:
+            start_idx = bitmask_indices[-1]
+
+        return [
+            (bitmask_indices + [idx], current_mask | bitmasks[ship_size][idx])
+            for idx in range(start_idx, len(bitmasks[ship_size]))
+            if current_mask & bitmasks[ship_size][idx] == 0
+        ]
 
-    def analyze_parallel(self) -> list[list[float]]:
+    @profiling.phase("_balanced_tasks")
+    def _balanced_tasks(
+        self,
+        ship_sizes: list[int],
+        bitmasks: dict[int, list[int]],
+        weights: dict[int, int],
+        n_workers: int,
+        max_depth: int = 3,
+        tasks_per_worker: int = 8
+    ) -> list[tuple[list[int], int, int]]:
+        """Split the most expensive subtrees at the second or third ship until the tasks are balanced, largest first."""
+        # heap of (-cost, tie breaker, bitmask_indices, current_mask, weight)
+        heap = []
+        for idx, weight in weights.items():
+            current_mask = bitmasks[ship_sizes[0]][idx]
+            cost = self._estimate_subtree_cost(ship_sizes[1:], current_mask, bitmasks)
+            heap.append((-cost, len(heap), [idx], current_mask, weight))
+        heapq.heapify(heap)
+
+        total_cost = -sum(task[0] for task in heap)
+        target_cost = total_cost / (n_workers * tasks_per_worker)
+
+        counter = len(heap)
+        while heap and -heap[0][0] > target_cost:
+            cost, _, bitmask_indices, current_mask, weight = heap[0]
+            depth = len(bitmask_indices)
+            if depth >= max_depth or depth >= len(ship_sizes) - 1:
+                break
+            heapq.heappop(heap)
+            for child_indices, child_mask in self._split_task(ship_sizes, bitmask_indices, current_mask, bitmasks):
+                child_cost = self._estimate_subtree_cost(ship_sizes[depth + 1:], child_mask, bitmasks)
+                heapq.heappush(heap, (-child_cost, counter, child_indices, child_mask, weight))
+                counter += 1
+
+        return [(bitmask_indices, current_mask, weight)
+                for _, _, bitmask_indices, current_mask, weight in sorted(heap)]
+
+    @profiling.profiled_turn
+    def analyze_parallel(self, processes: int = None) -> list[list[float]]:
+        """Analyze the board like analyze, spreading the first ship positions over a process pool."""
         positions = self._generate_valid_positions()
         bitmasks = self._generate_bitmasks(positions)
+        position_arrays = self._generate_position_arrays(positions)
         ship_sizes = sorted(self.ship_sizes)[::-1]
-        width, height = self.width, self.height
 
-        args_list = [
-            (self, ship_sizes[0], idx, positions, bitmasks, ship_sizes, width, height)
-            for idx in range(len(bitmasks[ship_sizes[0]]))
-        ]
+        symmetries, weights = self._first_ship_orbits(positions, monotone=True)
+
+        processes = processes or os.cpu_count()
+
+        # Largest subtrees first, expensive ones split further, so no worker
+        # is left with a long tail
+        tasks = self._balanced_tasks(ship_sizes, bitmasks, weights, processes)
 
-        with multiprocessing.Pool(7) as pool:
-            results = list(tqdm(pool.imap_unordered(Board._worker_task, args_list), total=len(args_list), desc="Placing first ship"))
+        with multiprocessing.Pool(
+            processes,
+            initializer=Board._init_worker,
+            initargs=((self.width, self.height, self.ship_sizes), positions, bitmasks, position_arrays, ship_sizes)
+        ) as pool:
+            # Accumulate the orbit weighted task boards as they arrive into
+            # one board instead of keeping all of them
+            probability_board = np.zeros((self.height, self.width))
+            for task_board in tqdm(pool.imap_unordered(Board._worker_task, tasks), total=len(tasks), desc="Placing ships"):
+                probability_board += task_board
 
-        # Aggregate results
-        probability_board = [[0 for _ in range(width)] for _ in range(height)]
-        for local_board in results:
-            for r in range(height):
-                for c in range(width):
-                    probability_board[r][c] += local_board[r][c]
+        probability_board = self._unfold_weighted_boards({1: probability_board}, symmetries)
 
         # Normalize
         return self._normalize_probabilities(probability_board)
 
 
+# Placement tables of the analyze_parallel worker processes, see Board._init_worker
+_worker_state = {}
+
+
 def test_analyze():
     board = Board(10, 10, [6, 4, 4, 3, 3])
     prob_board = board.analyze_parallel()